@@ -1,29 +1,140 @@
 #!/usr/bin/env python3
+"""
+Convert ARG-Needle / THReaD-S .argn files to tskit .trees.
+
+Every file becomes {name}.trees next to it, or the output given for it in a
+--manifest (one .argn per line, optionally followed by its output path).
+One process converts all of them, so arg_needle_lib is imported once rather
+than once per file. With --processes above 1 the files are converted by a
+pool of forked workers, which inherit the import. --max-memory bounds the
+estimated memory of the conversions running at once, each estimated as
+--memory-factor times its .argn's size, so large regions run fewer at a
+time. A file above the bound runs alone.
+
+With --compress, outputs are written with tszip ({name}.trees.tsz).
+Outputs are written under a temporary name and renamed when complete.
+"""
 
 import argparse
 import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
 import arg_needle_lib
 
+# Default peak memory of one conversion, as a multiple of its .argn size
+MEMORY_FACTOR = 20
+
+
+def default_output_path(argn_file, compress=False):
+    """Replace the .argn suffix with .trees (.trees.tsz when compressed)."""
+    if not argn_file.endswith(".argn"):
+        raise ValueError(f"Input file must end with .argn: {argn_file}")
+    return argn_file.removesuffix(".argn") + (".trees.tsz" if compress else ".trees")
+
+
+def read_manifest(path, compress=False):
+    """(input, output) pairs of a manifest; blank lines and # comments are skipped."""
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            pairs.append((fields[0], fields[1] if len(fields) > 1 else default_output_path(fields[0], compress)))
+    return pairs
+
+
+def convert_file(argn_file, output_file, compress=False):
+    arg = arg_needle_lib.deserialize_arg(argn_file)
+    ts = arg_needle_lib.arg_to_tskit(arg)
+    tmp_path = f"{output_file}.{os.getpid()}.tmp"
+    if compress:
+        import tszip
+
+        tszip.compress(ts, tmp_path)
+    else:
+        ts.dump(tmp_path)
+    os.replace(tmp_path, output_file)
+    return output_file
+
+
+def convert_files(pairs, processes=1, max_memory_mb=None, memory_factor=MEMORY_FACTOR, compress=False):
+    """Convert (input, output) pairs; returns {input: error} for the files that failed."""
+    failures = {}
+    if processes <= 1:
+        for argn_file, output_file in pairs:
+            try:
+                convert_file(argn_file, output_file, compress)
+                print(f"Converted {argn_file} → {output_file}")
+            except Exception as e:
+                failures[argn_file] = f"{type(e).__name__}: {e}"
+        return failures
+
+    budget = max_memory_mb * 2**20 if max_memory_mb else float("inf")
+    queue = []
+    for argn_file, output_file in pairs:
+        try:
+            queue.append((argn_file, output_file, memory_factor * os.path.getsize(argn_file)))
+        except OSError as e:
+            failures[argn_file] = f"{type(e).__name__}: {e}"
+
+    running = {}
+    in_use = 0
+    # Forked workers share the parent's arg_needle_lib import
+    with ProcessPoolExecutor(processes, mp_context=get_context("fork")) as pool:
+        while queue or running:
+            # Start the first queued files that fit in the memory left (any one when idle)
+            i = 0
+            while i < len(queue) and len(running) < processes:
+                argn_file, output_file, estimate = queue[i]
+                if running and in_use + estimate > budget:
+                    i += 1
+                    continue
+                del queue[i]
+                future = pool.submit(convert_file, argn_file, output_file, compress)
+                running[future] = (argn_file, output_file, estimate)
+                in_use += estimate
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                argn_file, output_file, estimate = running.pop(future)
+                in_use -= estimate
+                try:
+                    future.result()
+                    print(f"Converted {argn_file} → {output_file}", flush=True)
+                except Exception as e:
+                    failures[argn_file] = f"{type(e).__name__}: {e}"
+    return failures
+
+
 def main():
-    parser = argparse.ArgumentParser(description="Convert an ArgNeedle .argn file to a tskit .trees file")
-    parser.add_argument("argn_file", help="Path to the .argn file to convert")
+    parser = argparse.ArgumentParser(description="Convert ArgNeedle .argn files to tskit .trees files")
+    parser.add_argument("argn_files", nargs="*", help="Paths to the .argn files to convert")
+    parser.add_argument("--manifest", default=None,
+                        help="File listing .argn files to convert, one per line, each optionally followed by its output")
+    parser.add_argument("-p", "--processes", type=int, default=1, help="Worker processes (default: 1)")
+    parser.add_argument("--max-memory", type=float, default=None,
+                        help="MB shared by the conversions running at once (default: no bound)")
+    parser.add_argument("--memory-factor", type=float, default=MEMORY_FACTOR,
+                        help=f"Estimated peak memory of a conversion per byte of .argn (default: {MEMORY_FACTOR})")
+    parser.add_argument("--compress", action="store_true", help="Write tszip-compressed .trees.tsz files")
     args = parser.parse_args()
 
-    input_path = args.argn_file
-    if not input_path.endswith(".argn"):
-        raise ValueError("Input file must end with .argn")
+    pairs = [(path, default_output_path(path, args.compress)) for path in args.argn_files]
+    if args.manifest:
+        pairs += read_manifest(args.manifest, args.compress)
+    if not pairs:
+        parser.error("give .argn files or --manifest")
 
-    # Create output path by replacing .argn with .trees
-    output_path = os.path.splitext(input_path)[0] + ".trees"
+    failures = convert_files(pairs, args.processes, args.max_memory, args.memory_factor, args.compress)
+    for argn_file, error in failures.items():
+        print(f"Failed to convert {argn_file}: {error}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+    if len(pairs) > 1:
+        print(f"Converted {len(pairs)} files")
 
-    # Deserialize and convert
-    myarg = arg_needle_lib.deserialize_arg(input_path)
-    myarg_tskit = arg_needle_lib.arg_to_tskit(myarg)
-
-    # Dump to .trees
-    myarg_tskit.dump(output_path)
-    print(f"Converted {input_path} → {output_path}")
 
 if __name__ == "__main__":
     main()
-
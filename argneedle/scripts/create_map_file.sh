@@ -1,7 +1,15 @@
 #!/bin/bash
 
 input=$1  # e.g. chr14.27572179.28322179.CHB_301.YRI_0.seed_32.no_multi_allelics.haps
+recomb_map=$2  # optional HapMap-style map; without it genetic positions are written as 0
+cache_dir=$3  # optional directory of parsed maps shared across runs
 filename=${input%.haps}.map
 
-awk 'BEGIN{OFS="\t"} {print $1, $2, 0, $3}' "$input" > "$filename"
-
+if [ -n "$recomb_map" ]; then
+    script_dir=$(dirname "$(readlink -f "$0")")
+    python "$script_dir/../../shared/scripts/recomb_map.py" "$recomb_map" \
+        --format argneedle --haps "$input" -o "$filename" \
+        ${cache_dir:+--cache-dir "$cache_dir"}
+else
+    awk 'BEGIN{OFS="\t"} {print $1, $2, 0, $3}' "$input" > "$filename"
+fi
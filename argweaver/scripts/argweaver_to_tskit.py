@@ -1,28 +1,47 @@
 #!/usr/bin/env python3
 
 import argparse
-import collections
-import pandas as pd
-import networkx as nx
+import glob
+import gzip
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+import pandas as pd
 import tskit
-import os
 
 
-'''
-Currently this function doesn't work
-alternative approach take bed file and create a list of local trees using tskit function .from_newick
-'''
+def _topological_rank(child, parent, n):
+    """
+    Longest-path rank of each node over the given child -> parent edges.
+
+    Only edges between nodes of equal age are passed in, so the chains are
+    short and the relaxation converges in a handful of vectorized sweeps.
+    """
+    rank = np.zeros(n, dtype=np.int64)
+    for _ in range(n + 1):
+        updated = rank.copy()
+        np.maximum.at(updated, parent, rank[child] + 1)
+        if np.array_equal(updated, rank):
+            return rank
+        rank = updated
+    raise ValueError("Cycle found among nodes of equal age")
+
 
 def convert_argweaver(infile, filename=None):
     """
     Convert an ARGweaver .arg file to a tskit tree sequence.
-    Function from Yan Wong: https://github.com/tskit-dev/what-is-an-arg-paper/blob/3d3b4309182a6f85ec98c74f23aa4a72bbb0dda9/argutils/convert.py#L12
+    Adapted from Yan Wong: https://github.com/tskit-dev/what-is-an-arg-paper/blob/3d3b4309182a6f85ec98c74f23aa4a72bbb0dda9/argutils/convert.py#L12
+    Nodes are ordered by age (ties broken topologically) and the node and edge
+    tables are built with whole-column operations.
     Parameters
     ----------
     infile : file handle
         Opened .arg file (text mode).
+    filename : str, optional
+        Name used in error messages.
     """
+    label = filename or "ARGweaver file"
     start, end = next(infile).strip().split()
     assert start.startswith("start=")
     start = int(start[len("start="):])
@@ -30,101 +49,152 @@ def convert_argweaver(infile, filename=None):
     end = int(end[len("end="):])
 
     df = pd.read_csv(infile, header=0, sep="\t", dtype={"name": str, "parents": str})
-    for col in ("name", "parents", "age"):
+    for col in ("name", "event", "age", "pos", "parents"):
         if col not in df.columns:
             raise ValueError(f"Column {col} not found in ARGweaver file")
 
-    name_to_record = {str(row["name"]): dict(row) for _, row in df.iterrows()}
-
-    parent_map = collections.defaultdict(list)
-    G = nx.DiGraph()
-    time_map = {}
-
-    for row in name_to_record.values():
-        child = row["name"]
-        parents = row["parents"]
-        time_map[row["age"]] = row["age"]
-        G.add_node(child)
-        if isinstance(parents, str):
-            for parent in parents.split(","):
-                G.add_edge(child, parent)
-                parent_map[child].append(parent)
+    n = len(df)
+    names = pd.Index(df["name"])
+    if not names.is_unique:
+        raise ValueError(f"Duplicate node names in {label}")
+    age = df["age"].to_numpy(dtype=np.float64)
+    is_sample = (df["event"] == "gene").to_numpy()
+    if np.any(age[is_sample] != 0):
+        raise ValueError(f"Sample (gene) nodes must have age 0 in {label}")
+
+    # Map parent names to row indices; recombination nodes list two parents.
+    parent_names = (
+        df["parents"].fillna("").str.split(",", expand=True).reindex(columns=[0, 1]).fillna("")
+    )
+    parents = np.stack([names.get_indexer(parent_names[k]) for k in (0, 1)], axis=1)
+    unknown = (parents < 0) & (parent_names.to_numpy() != "")
+    if np.any(unknown):
+        missing = sorted(set(parent_names.to_numpy()[unknown]))
+        raise ValueError(f"Unknown parent names in {label}: {missing[:10]}")
+
+    has_parent = parents >= 0
+    edge_child = np.concatenate([np.flatnonzero(has_parent[:, k]) for k in (0, 1)])
+    edge_parent = np.concatenate([parents[has_parent[:, k], k] for k in (0, 1)])
+    if np.any(age[edge_parent] < age[edge_child]):
+        raise ValueError(f"Parent younger than child in {label}")
+
+    # Order nodes by age; nodes sharing an age are ordered children-first.
+    same_age = age[edge_parent] == age[edge_child]
+    rank = _topological_rank(edge_child[same_age], edge_parent[same_age], n)
+    order = np.lexsort((rank, age))
+    node_id = np.empty(n, dtype=np.int32)
+    node_id[order] = np.arange(n, dtype=np.int32)
+
+    # Separate tied ages by small offsets so every parent is strictly older.
+    sorted_age = age[order]
+    unique_ages = np.unique(sorted_age)
+    min_time_diff = np.diff(unique_ages).min() if len(unique_ages) > 1 else 1.0
+    epsilon = min_time_diff / max(1e6, n)
+    within_age = np.arange(n) - np.searchsorted(sorted_age, sorted_age, side="left")
+    time = sorted_age + epsilon * within_age
+    time[is_sample[order]] = 0
 
     tables = tskit.TableCollection(sequence_length=end)
+    metadata = [line.encode() for line in df.iloc[order].to_json(orient="records", lines=True).splitlines()]
+    metadata, metadata_offset = tskit.pack_bytes(metadata)
+    tables.nodes.set_columns(
+        flags=np.where(is_sample[order], tskit.NODE_IS_SAMPLE, 0).astype(np.uint32),
+        time=time,
+        metadata=metadata,
+        metadata_offset=metadata_offset,
+    )
     tables.nodes.metadata_schema = tskit.MetadataSchema.permissive_json()
-    breakpoints = np.full(len(G), tables.sequence_length)
-    aw_to_tsk_id = {}
-
-    min_time_diff = min(np.diff(sorted(time_map.keys())))
-    epsilon = min_time_diff / 1e6
-
-    try:
-        for node in nx.lexicographical_topological_sort(G):
-            record = name_to_record[node]
-            flags = 0
-            if record["event"] == "gene":
-                flags = tskit.NODE_IS_SAMPLE
-                assert record["age"] == 0
-                time = record["age"]
-            else:
-                if record["age"] == 0:
-                    time_map[record["age"]] += epsilon
-                time = time_map[record["age"]]
-                time_map[record["age"]] += epsilon
-            tsk_id = tables.nodes.add_row(flags=flags, time=time, metadata=record)
-            aw_to_tsk_id[node] = tsk_id
-            if record["event"] == "recomb":
-                breakpoints[tsk_id] = record["pos"]
-    except nx.exception.NetworkXUnfeasible:
-        bad_edges = nx.find_cycle(G, orientation="original")
-        raise nx.exception.NetworkXUnfeasible(
-            f"Cycle found in ARGweaver graph ({filename}): {bad_edges}"
-        )
 
+    # Single-parent nodes span the whole sequence; recombination nodes switch
+    # from the first to the second parent at their breakpoint.
     L = tables.sequence_length
-    for aw_node in G:
-        child = aw_to_tsk_id[aw_node]
-        parents = [aw_to_tsk_id[p] for p in parent_map[aw_node]]
-        if len(parents) == 1:
-            tables.edges.add_row(0, L, parents[0], child)
-        elif len(parents) == 2:
-            x = breakpoints[child]
-            tables.edges.add_row(0, x, parents[0], child)
-            tables.edges.add_row(x, L, parents[1], child)
-        else:
-            assert len(parents) == 0
+    two_parents = has_parent[:, 1]
+    breakpoint = np.where(two_parents, df["pos"].fillna(L).to_numpy(dtype=np.float64), L)
+    rows = np.flatnonzero(has_parent[:, 0])
+    recomb_rows = np.flatnonzero(two_parents)
+    left = np.concatenate([np.zeros(len(rows)), breakpoint[recomb_rows]])
+    right = np.concatenate([breakpoint[rows], np.full(len(recomb_rows), L)])
+    parent = np.concatenate([parents[rows, 0], parents[recomb_rows, 1]])
+    child = np.concatenate([rows, recomb_rows])
+    keep = left < right
+    tables.edges.set_columns(
+        left=left[keep],
+        right=right[keep],
+        parent=node_id[parent[keep]],
+        child=node_id[child[keep]],
+    )
 
     tables.sort()
     ts = tables.tree_sequence()
     return ts.simplify(keep_unary=True)
 
 
+def default_output_path(arg_file, outdir=None):
+    """Replace the .arg / .arg.gz suffix with .tskit.trees, optionally in outdir."""
+    base = arg_file.removesuffix(".gz").removesuffix(".arg")
+    if outdir:
+        base = os.path.join(outdir, os.path.basename(base))
+    return base + ".tskit.trees"
+
+
+def convert_file(arg_file, output_file):
+    opener = gzip.open if arg_file.endswith(".gz") else open
+    with opener(arg_file, "rt") as infile:
+        ts = convert_argweaver(infile, filename=os.path.basename(arg_file))
+    ts.dump(output_file)
+    return output_file
+
+
+def convert_directory(arg_dir, outdir=None, processes=None):
+    """
+    Convert every .arg / .arg.gz MCMC sample in arg_dir using a process pool.
+    Returns the list of written .trees paths.
+    """
+    arg_files = sorted(
+        glob.glob(os.path.join(arg_dir, "*.arg")) + glob.glob(os.path.join(arg_dir, "*.arg.gz"))
+    )
+    if not arg_files:
+        raise FileNotFoundError(f"No .arg files found in {arg_dir}")
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    outputs = [default_output_path(f, outdir) for f in arg_files]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(convert_file, arg_files, outputs))
+
+
 def main():
     parser = argparse.ArgumentParser(
-        description="Convert ARGweaver .arg file to .tskit.trees format"
+        description="Convert ARGweaver .arg file(s) to .tskit.trees format"
     )
     parser.add_argument(
         "arg_file",
-        help="Input ARGweaver .arg file"
+        help="Input ARGweaver .arg file, or a directory of .arg/.arg.gz samples to convert in batch"
     )
     parser.add_argument(
         "-o", "--output",
-        help="Output filename (defaults to replacing .arg with .tskit.trees)"
+        help="Output filename (defaults to replacing .arg with .tskit.trees); "
+             "output directory in batch mode"
+    )
+    parser.add_argument(
+        "-p", "--processes", type=int, default=None,
+        help="Worker processes in batch mode (default: all cores)"
     )
 
     args = parser.parse_args()
 
+    if os.path.isdir(args.arg_file):
+        outputs = convert_directory(args.arg_file, outdir=args.output, processes=args.processes)
+        print(f"Converted {len(outputs)} ARGweaver samples from {args.arg_file}")
+        return
+
     if args.output:
         output_file = args.output
     else:
-        if not args.arg_file.endswith(".arg"):
+        if not args.arg_file.endswith((".arg", ".arg.gz")):
             raise ValueError("Input file must end with .arg or specify --output")
-        output_file = args.arg_file[:-4] + ".tskit.trees"
-
-    with open(args.arg_file, "r") as infile:
-        ts = convert_argweaver(infile, filename=os.path.basename(args.arg_file))
+        output_file = default_output_path(args.arg_file)
 
-    ts.dump(output_file)
+    convert_file(args.arg_file, output_file)
     print(f"Tree sequence written to {output_file}")
 
 
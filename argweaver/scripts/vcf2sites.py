@@ -1,9 +1,19 @@
 #!/usr/bin/env python3
 
-import sys
 import argparse
+import itertools
+import numpy as np
 from cyvcf2 import VCF
 
+# Allele codes looked up per site: REF, up to three ALTs, and "N" in the last
+# column so that missing genotypes (-1) index straight into it.
+MAX_ALLELES = 4
+N_CODE = ord("N")
+
+# Width reserved for the REGION end coordinate when it is only known after the
+# last site has been read; the line is patched in place at the end.
+REGION_END_WIDTH = 20
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -15,56 +25,133 @@ def parse_args():
     parser.add_argument(
         "--out", required=True, help="Output sites file name."
     )
+    parser.add_argument(
+        "--region", default=None,
+        help="Region to extract as chrom:start-end (requires a tabix index). "
+             "Also used for the REGION line. Default: all sites in the VCF."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=10000,
+        help="Number of sites converted per batch (default: 10000)"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1,
+        help="Threads used by htslib for decompression (default: 1)"
+    )
     return parser.parse_args()
 
 
+def parse_region(region):
+    """Split a chrom:start-end string into (chrom, start, end)."""
+    chrom, _, span = region.rpartition(":")
+    start, _, end = span.partition("-")
+    if not chrom or not start or not end:
+        raise ValueError(f"Region must be chrom:start-end, got: {region}")
+    return chrom, int(start), int(end)
+
+
+def iter_site_batches(records, num_samples, batch_size):
+    """
+    Yield (chroms, positions, bases) for batches of up to batch_size SNPs.
+
+    bases is a (n_sites, 2 * num_samples) uint8 array of ASCII allele codes,
+    haplotypes ordered as sample0_0, sample0_1, sample1_0, ...
+    Non-SNP records are skipped.
+    """
+    n_haps = 2 * num_samples
+    positions = np.empty(batch_size, dtype=np.int64)
+    genotypes = np.empty((batch_size, n_haps), dtype=np.int16)
+    lookup = np.full((batch_size, MAX_ALLELES + 1), N_CODE, dtype=np.uint8)
+    chroms = []
+    n = 0
+
+    for variant in records:
+        alleles = [variant.REF] + variant.ALT
+        if any(len(a) != 1 for a in alleles):
+            continue
+        alleles = alleles[:MAX_ALLELES]
+        chroms.append(variant.CHROM)
+        positions[n] = variant.POS
+        genotypes[n] = variant.genotype.array()[:, :2].ravel()
+        lookup[n, :] = N_CODE
+        lookup[n, :len(alleles)] = np.frombuffer("".join(alleles).encode(), dtype=np.uint8)
+        n += 1
+        if n == batch_size:
+            yield chroms, positions.copy(), _lookup_bases(lookup, genotypes)
+            chroms = []
+            n = 0
+
+    if n:
+        yield chroms, positions[:n], _lookup_bases(lookup[:n], genotypes[:n])
+
+
+def _lookup_bases(lookup, genotypes):
+    # Alleles beyond MAX_ALLELES are treated as missing; -1 indexes the "N" column.
+    gts = genotypes.astype(np.intp)
+    gts[gts >= MAX_ALLELES] = -1
+    return np.take_along_axis(lookup, gts, axis=1)
+
+
+def write_rows(out, positions, bases):
+    out.write(b"".join(
+        b"%d\t%s\n" % (pos, row.tobytes()) for pos, row in zip(positions.tolist(), bases)
+    ))
+
+
+def vcf_to_sites(vcf_file, output_file, region=None, batch_size=10000, threads=1):
+    """
+    Stream a phased VCF into an ARGweaver .sites file.
+
+    Genotypes are converted in batches of batch_size sites, so memory does not
+    grow with the number of sites. Returns the number of sites written.
+    """
+    vcf = VCF(vcf_file, threads=threads)
+    hap_names = [f"{name}_{i}" for name in vcf.samples for i in range(2)]
+    records = vcf(region) if region else vcf
+    batches = iter_site_batches(records, len(vcf.samples), batch_size)
+
+    first = next(batches, None)
+    if first is None:
+        raise ValueError(f"No SNPs found in {vcf_file}" + (f" for region {region}" if region else ""))
+
+    if region:
+        chrom, start, end = parse_region(region)
+        region_end = str(end)
+    else:
+        chrom, start = first[0][0], int(first[1][0])
+        region_end = " " * REGION_END_WIDTH
+
+    num_sites = 0
+    last_pos = start
+    with open(output_file, "wb") as f:
+        f.write("NAMES\t{}\n".format("\t".join(hap_names)).encode())
+        region_offset = f.tell()
+        f.write(f"REGION\t{chrom}\t{start}\t{region_end}\n".encode())
+
+        for chroms, positions, bases in itertools.chain([first], batches):
+            write_rows(f, positions, bases)
+            num_sites += len(positions)
+            last_pos = int(positions[-1])
+
+        if not region:
+            # Fields are whitespace delimited, so the padding is ignored by arg-sample.
+            f.seek(region_offset)
+            f.write(f"REGION\t{chrom}\t{start}\t{str(last_pos).ljust(REGION_END_WIDTH)}\n".encode())
+
+    return num_sites
+
+
 def main():
     args = parse_args()
-    vcf_file = args.vcf
-    output_file = args.out
-
-    # Read VCF
-    vcf = VCF(vcf_file)
-
-    # Get region info (first contig + min/max POS)
-    chrom = None
-    positions = []
-    for variant in vcf:
-        if chrom is None:
-            chrom = variant.CHROM
-        positions.append(variant.POS)
-    region = [chrom, str(min(positions)), str(max(positions))]
-
-    # Get samples
-    samples = vcf.samples
-    num_samples = len(samples)
-
-    # Hap names: diploid individuals → two haplotypes each
-    hap_names = [f"{name}_{i}" for name in samples for i in range(2)]
-
-    # Extract haplotype sequences
-    vcf = VCF(vcf_file)  # re-open to iterate again
-    data = []
-    for variant in vcf:
-        pos = variant.POS
-        phased = [gt[:2] for gt in variant.genotypes]
-        hap1 = [variant.REF, variant.ALT[0]]
-        bases = []
-        for gt in phased:
-            bases.append(hap1[gt[0]])
-            bases.append(hap1[gt[1]])
-        data.append([pos, "".join(bases)])
-
-    # Write sites file
-    with open(output_file, "w") as f:
-        f.write("NAMES\t{}\n".format("\t".join(hap_names)))
-        f.write("REGION\t{}\n".format("\t".join(region)))
-        for row in data:
-            f.write("{}\t{}\n".format(row[0], row[1]))
-
-    print(f"Wrote {output_file}")
+    num_sites = vcf_to_sites(
+        args.vcf,
+        args.out,
+        region=args.region,
+        batch_size=args.batch_size,
+        threads=args.threads,
+    )
+    print(f"Wrote {num_sites} sites to {args.out}")
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Benchmark the conversion and preprocessing scripts on synthetic data.
+
+For every sample size and region length of the grid, a dataset is simulated
+with msprime (synthetic_data.py; reused if already in --data-dir) and the core
+function of each script is run on it:
+
+  vcf2sites                argweaver/scripts/vcf2sites.py      vcf_to_sites
+  variant_selector         preprocessing/scripts/variant_selector.py  select_top_variants
+  process_mapfile          relate/scripts/process_mapfile.py   convert_hapmap_to_relate
+  process_mapfile_cached     ... with a warm recomb_map cache
+  argweaver_to_tskit       argweaver/scripts/argweaver_to_tskit.py  convert_file
+  ancestral_states         tsinfer/scripts/run_tsinfer.py      load_ancestral_states
+  ancestral_states_cached    ... with a warm ancestral state cache
+  generate_ancestors       tsinfer/scripts/run_tsinfer.py      generate_ancestors_stage
+
+generate_ancestors runs the first tsinfer stage of the workflow (ancestral
+states into the .vcz, then tsinfer.generate_ancestors on one thread) on a .vcz
+that bio2zarr converts from the dataset's VCF on first use and keeps beside it.
+
+Each run is a fresh (spawned) process, so peak RSS is that of one call:
+peak_rss_mb is the process's high-water mark after the call, base_rss_mb
+before it (interpreter, imports, setup) and delta_rss_mb their difference,
+the memory the call itself added. Inputs are read once, untimed, before
+the call so timings measure the function rather than a cold page cache. With
+--repeat, wall_seconds is the fastest run and throughput is input rows (sites
+for VCFs and position lookups) per second of it.
+
+Results are written as JSON. `compare` (or `run --baseline`) matches cases of
+two results files and reports wall time and delta RSS ratios, exiting with
+status 1 if any case got slower or bigger than the thresholds allow.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_data import dataset_name, generate
+
+REPO = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+
+# Packages whose versions are recorded with the results
+VERSIONS = ["numpy", "pandas", "pyarrow", "cyvcf2", "pyfaidx", "tskit", "msprime", "tsinfer", "bio2zarr"]
+# Smallest delta RSS compared, so calls that allocate almost nothing do not give huge ratios
+MIN_DELTA_RSS_MB = 1.0
+
+
+def load_script(path):
+    """Import a repo script as a module, with its own directory importable (as when run directly)."""
+    path = os.path.join(REPO, path)
+    sys.path.insert(0, os.path.dirname(path))
+    name = os.path.basename(path).removesuffix(".py")
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_input(path):
+    """Read a file once so the timed call does not pay for a cold page cache."""
+    with open(path, "rb") as f:
+        while f.read(1 << 24):
+            pass
+
+
+# Each case returns the timed call after doing its (untimed) setup in tmp.
+
+def vcf2sites(module, files, tmp):
+    read_input(files["vcf"])
+    return lambda: module.vcf_to_sites(files["vcf"], os.path.join(tmp, "out.sites"))
+
+
+def variant_selector(module, files, tmp):
+    read_input(files["afreq"])
+    return lambda: module.select_top_variants(files["afreq"], os.path.join(tmp, "top.txt"))
+
+
+def process_mapfile(module, files, tmp, cached=False):
+    read_input(files["hapmap"])
+    cache_dir = os.path.join(tmp, "cache") if cached else None
+    out = os.path.join(tmp, "map.processed.relate")
+    if cached:
+        module.convert_hapmap_to_relate(files["hapmap"], 1, 2, 3, out, cache_dir)
+    return lambda: module.convert_hapmap_to_relate(files["hapmap"], 1, 2, 3, out, cache_dir)
+
+
+def argweaver_to_tskit(module, files, tmp):
+    read_input(files["arg"])
+    return lambda: module.convert_file(files["arg"], os.path.join(tmp, "out.trees"))
+
+
+def ancestral_states(module, files, tmp, cached=False):
+    positions = np.load(files["positions"])
+    module.pyfaidx.Fasta(files["fasta"])  # builds the .fai index on first use
+    read_input(files["fasta"])
+    cache_dir = os.path.join(tmp, "cache") if cached else None
+    if cached:
+        module.load_ancestral_states(files["fasta"], files["chrom"], positions, cache_dir)
+    return lambda: module.load_ancestral_states(files["fasta"], files["chrom"], positions, cache_dir)
+
+
+def dataset_vcz(vcf):
+    """The dataset's .vcz beside its VCF, converted with bio2zarr on first use."""
+    path = vcf.removesuffix(".vcf.gz") + ".vcz"
+    if not os.path.exists(path):
+        from bio2zarr import vcf2zarr
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        vcf2zarr.convert([vcf], tmp_path, worker_processes=0)
+        os.replace(tmp_path, path)
+    return path
+
+
+def generate_ancestors(module, files, tmp):
+    # The stage adds the ancestral_state array to the .vcz, so each run gets its own copy
+    vcz = os.path.join(tmp, "data.vcz")
+    shutil.copytree(dataset_vcz(files["vcf"]), vcz)
+    module.pyfaidx.Fasta(files["fasta"])
+    read_input(files["fasta"])
+    args = argparse.Namespace(region=None, fasta=files["fasta"], chrom=files["chrom"],
+                              ancestral_cache=None, threads=1)
+    return lambda: module.generate_ancestors_stage(args, vcz, os.path.join(tmp, "out.ancestors"))
+
+
+# name: (script, case function, input counted for throughput, unit, extra arguments)
+CASES = {
+    "vcf2sites": ("argweaver/scripts/vcf2sites.py", vcf2sites, "vcf", "sites", {}),
+    "variant_selector": ("preprocessing/scripts/variant_selector.py", variant_selector, "afreq", "rows", {}),
+    "process_mapfile": ("relate/scripts/process_mapfile.py", process_mapfile, "hapmap", "rows", {}),
+    "process_mapfile_cached": ("relate/scripts/process_mapfile.py", process_mapfile, "hapmap", "rows",
+                               {"cached": True}),
+    "argweaver_to_tskit": ("argweaver/scripts/argweaver_to_tskit.py", argweaver_to_tskit, "arg", "rows", {}),
+    "ancestral_states": ("tsinfer/scripts/run_tsinfer.py", ancestral_states, "positions", "sites", {}),
+    "ancestral_states_cached": ("tsinfer/scripts/run_tsinfer.py", ancestral_states, "positions", "sites",
+                                {"cached": True}),
+    "generate_ancestors": ("tsinfer/scripts/run_tsinfer.py", generate_ancestors, "vcf", "sites", {}),
+}
+
+
+def max_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(case, manifest):
+    """Run one case once (in a worker process); returns wall time and RSS."""
+    script, function, _, _, options = CASES[case]
+    files = dict(manifest["files"], chrom=manifest["chrom"])
+    with tempfile.TemporaryDirectory() as tmp, open(os.devnull, "w") as devnull:
+        with contextlib.redirect_stdout(devnull):
+            call = function(load_script(script), files, tmp, **options)
+            base = max_rss_mb()
+            start = time.perf_counter()
+            call()
+            wall = time.perf_counter() - start
+    peak = max_rss_mb()
+    return {"wall_seconds": wall, "base_rss_mb": base, "peak_rss_mb": peak, "delta_rss_mb": peak - base}
+
+
+def benchmark(case, manifest, repeat=1):
+    """Result record of a case on one dataset, over repeat fresh processes."""
+    _, _, input_key, unit, _ = CASES[case]
+    record = {
+        "case": case,
+        "samples": manifest["samples"],
+        "length": manifest["length"],
+        "num_sites": manifest["rows"]["vcf"],
+        "items": manifest["rows"][input_key],
+        "unit": unit,
+    }
+    runs = []
+    try:
+        for _ in range(repeat):
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                runs.append(pool.submit(run_case, case, manifest).result())
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        return record
+    wall = min(run["wall_seconds"] for run in runs)
+    record.update({
+        "wall_seconds": wall,
+        "wall_seconds_all": [run["wall_seconds"] for run in runs],
+        "base_rss_mb": max(run["base_rss_mb"] for run in runs),
+        "peak_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "delta_rss_mb": max(run["delta_rss_mb"] for run in runs),
+        "throughput": record["items"] / wall if wall > 0 else None,
+    })
+    return record
+
+
+def environment():
+    """Machine, interpreter, package versions and git commit of this run."""
+    versions = {}
+    for name in VERSIONS:
+        try:
+            versions[name] = __import__(name).__version__
+        except Exception:
+            versions[name] = None
+    try:
+        commit = subprocess.run(["git", "-C", REPO, "rev-parse", "HEAD"], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "git_commit": commit,
+        "versions": versions,
+    }
+
+
+def run(cases, samples, lengths, data_dir, repeat=1, seed=1):
+    """Benchmark every case on every dataset of the grid; returns the results document."""
+    results = []
+    for n in samples:
+        for length in lengths:
+            manifest = generate(os.path.join(data_dir, dataset_name(n, length)), n, length, seed)
+            for case in cases:
+                record = benchmark(case, manifest, repeat)
+                results.append(record)
+                if "error" in record:
+                    print(f"{case} n={n} L={int(length)}: failed ({record['error']})", file=sys.stderr)
+                else:
+                    print(f"{case} n={n} L={int(length)}: {record['wall_seconds']:.3f} s, "
+                          f"{record['peak_rss_mb']:.0f} MB (+{record['delta_rss_mb']:.0f}), {record['throughput']:.4g} {record['unit']}/s", flush=True)
+    return {"environment": environment(), "repeat": repeat, "seed": seed, "results": results}
+
+
+def case_key(record):
+    return record["case"], record["samples"], record["length"]
+
+
+def delta_rss(record):
+    """Memory added by the call; computed for results files written before delta_rss_mb was recorded."""
+    delta = record.get("delta_rss_mb", record["peak_rss_mb"] - record["base_rss_mb"])
+    return max(delta, MIN_DELTA_RSS_MB)
+
+
+def compare(results, baseline, time_threshold=0.2, rss_threshold=0.2):
+    """
+    Rows (case, samples, length, wall ratio, delta RSS ratio, regressed) for cases in
+    both documents; ratios are current / baseline. Memory is compared without the
+    base RSS, which is mostly imports and would hide changes in the call itself.
+    """
+    previous = {case_key(r): r for r in baseline["results"] if "error" not in r}
+    rows = []
+    for record in results["results"]:
+        old = previous.get(case_key(record))
+        if old is None or "error" in record:
+            continue
+        time_ratio = record["wall_seconds"] / old["wall_seconds"]
+        rss_ratio = delta_rss(record) / delta_rss(old)
+        regressed = time_ratio > 1 + time_threshold or rss_ratio > 1 + rss_threshold
+        rows.append((*case_key(record), time_ratio, rss_ratio, regressed))
+    return rows
+
+
+def report(rows):
+    """Print a comparison table; returns the number of regressions."""
+    print("case\tsamples\tlength\twall_ratio\tdelta_rss_ratio\tstatus")
+    for case, n, length, time_ratio, rss_ratio, regressed in rows:
+        print(case, n, length, f"{time_ratio:.3f}", f"{rss_ratio:.3f}", "REGRESSION" if regressed else "ok", sep="\t")
+    return sum(row[-1] for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the conversion and preprocessing scripts on msprime-simulated data."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("run", help="Run the benchmarks and write a results file")
+    bench.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES),
+                       help="Cases to run (default: all)")
+    bench.add_argument("--samples", nargs="+", type=int, default=[10, 100],
+                       help="Diploid sample sizes (default: 10 100)")
+    bench.add_argument("--lengths", nargs="+", type=float, default=[1e6, 5e6],
+                       help="Region lengths in bp (default: 1e6 5e6)")
+    bench.add_argument("--repeat", type=int, default=3, help="Runs per case, fastest kept (default: 3)")
+    bench.add_argument("--seed", type=int, default=1, help="Simulation seed (default: 1)")
+    bench.add_argument("--data-dir", default="benchmark_data",
+                       help="Synthetic datasets, reused across runs (default: benchmark_data)")
+    bench.add_argument("--out", default="benchmark_results.json", help="Results file (default: benchmark_results.json)")
+    bench.add_argument("--baseline", default=None, help="Results file to compare against")
+    for sub in (bench, commands.add_parser("compare", help="Compare two results files")):
+        if sub is not bench:
+            sub.add_argument("results", help="Current results file")
+            sub.add_argument("baseline", help="Baseline results file")
+        sub.add_argument("--time-threshold", type=float, default=0.2,
+                         help="Allowed relative increase in wall time (default: 0.2)")
+        sub.add_argument("--rss-threshold", type=float, default=0.2,
+                         help="Allowed relative increase in delta RSS (default: 0.2)")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run(args.cases, args.samples, args.lengths, args.data_dir, args.repeat, args.seed)
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"Results written to {args.out}")
+        if args.baseline is None:
+            return
+        baseline_path = args.baseline
+    else:
+        with open(args.results) as f:
+            results = json.load(f)
+        baseline_path = args.baseline
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = report(compare(results, baseline, args.time_threshold, args.rss_threshold))
+    if regressions:
+        print(f"{regressions} regression(s) against {baseline_path}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Synthetic inputs for the benchmark suite, simulated with msprime.
+
+One dataset is a simulated region of `samples` diploid individuals and
+`length` bp, written in every input format the benchmarked scripts read:
+
+- {name}.vcf.gz: phased VCF of the simulated mutations (gzip, not indexed);
+- {name}.afreq: plink2 allele frequencies, one row per ALT allele with
+  CHR:POS:REF:ALT IDs, as written after preprocessing's normalization;
+- {name}.hapmap: HapMap recombination map, one row per `map_spacing` bp;
+- {name}.arg: ARGweaver ARG built from msprime's full ARG (each pair of
+  recombination nodes merged into one node with two parents);
+- {name}.fa: random ancestral sequence of the contig;
+- {name}.positions.npy: VCF site positions (ancestral state lookups).
+
+manifest.json records the files and their row counts and is written last,
+so a directory with a manifest is complete and is reused as is.
+"""
+
+import argparse
+import gzip
+import json
+import os
+
+import msprime
+import numpy as np
+import pandas as pd
+
+CHROM = "20"
+RECOMBINATION_RATE = 1e-8
+MUTATION_RATE = 1.25e-8
+POPULATION_SIZE = 1e4
+FASTA_LINE = 60
+
+
+def dataset_name(samples, length):
+    return f"n{samples}_L{int(length)}"
+
+
+def simulate(samples, length, seed=1):
+    """The full ARG and its simplified, mutated tree sequence (no site at position 0)."""
+    arg = msprime.sim_ancestry(
+        samples,
+        sequence_length=length,
+        recombination_rate=RECOMBINATION_RATE,
+        population_size=POPULATION_SIZE,
+        record_full_arg=True,
+        random_seed=seed,
+    )
+    ts = msprime.sim_mutations(arg.simplify(), rate=MUTATION_RATE, random_seed=seed)
+    # VCF positions are 1-based
+    return arg, ts.delete_sites(np.flatnonzero(ts.sites_position == 0))
+
+
+def write_vcf(ts, path):
+    with gzip.open(path, "wt", compresslevel=1) as f:
+        ts.write_vcf(f, contig_id=CHROM)
+    return ts.num_sites
+
+
+def write_afreq(ts, path):
+    """plink2 .afreq with biallelic rows (multi-allelic sites split, as after normalization)."""
+    rows = []
+    num_haplotypes = ts.num_samples
+    for variant in ts.variants():
+        counts = np.bincount(variant.genotypes, minlength=len(variant.alleles))
+        pos = int(variant.site.position)
+        ref = variant.alleles[0]
+        for k in range(1, len(variant.alleles)):
+            alt = variant.alleles[k]
+            rows.append((CHROM, f"{CHROM}:{pos}:{ref}:{alt}", ref, alt, "Y",
+                         counts[k] / num_haplotypes, num_haplotypes))
+    table = pd.DataFrame(rows, columns=["#CHROM", "ID", "REF", "ALT", "PROVISIONAL_REF?", "ALT_FREQS", "OBS_CT"])
+    table.to_csv(path, sep="\t", index=False)
+    return len(table)
+
+
+def write_hapmap(length, path, spacing, rng):
+    """HapMap map with log-normal rates (cM/Mb) every spacing bp."""
+    position = np.arange(1, length, spacing, dtype=np.int64)
+    rate = rng.lognormal(0, 1, len(position))
+    cm = np.concatenate([[0.0], np.cumsum(rate[:-1] * np.diff(position) / 1e6)])
+    table = pd.DataFrame({
+        "Chromosome": f"chr{CHROM}",
+        "Position(bp)": position,
+        "Rate(cM/Mb)": np.round(rate, 6),
+        "Map(cM)": np.round(cm, 6),
+    })
+    table.to_csv(path, sep="\t", index=False)
+    return len(table)
+
+
+def write_fasta(length, path, rng):
+    """Random ACGT sequence with lower-case (soft-masked) runs, FASTA_LINE bases per line."""
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)[rng.integers(0, 4, int(length))]
+    masked = np.repeat(rng.random(int(length) // 1000 + 1) < 0.1, 1000)[:len(bases)]
+    bases[masked] += ord("a") - ord("A")
+    with open(path, "wb") as f:
+        f.write(f">{CHROM}\n".encode())
+        full = len(bases) // FASTA_LINE * FASTA_LINE
+        lines = np.empty((full // FASTA_LINE, FASTA_LINE + 1), dtype=np.uint8)
+        lines[:, :FASTA_LINE] = bases[:full].reshape(-1, FASTA_LINE)
+        lines[:, FASTA_LINE] = ord("\n")
+        f.write(lines.tobytes())
+        if full < len(bases):
+            f.write(bases[full:].tobytes() + b"\n")
+
+
+def write_arg(arg, path):
+    """
+    Write msprime's full ARG in ARGweaver's .arg format; returns the number of nodes.
+
+    msprime records a recombination as two nodes, one per side of the
+    breakpoint, above the same child; ARGweaver has one node with two
+    parents (left, right) and the breakpoint as pos. Other nodes have at most
+    one parent.
+    """
+    is_recomb = (arg.nodes_flags & msprime.NODE_IS_RE_EVENT) != 0
+    # Distinct child -> parent links, with the leftmost coordinate of each
+    key = arg.edges_child.astype(np.int64) * arg.num_nodes + arg.edges_parent
+    links = np.unique(key)
+    child, parent = links // arg.num_nodes, links % arg.num_nodes
+    left = pd.Series(arg.edges_left).groupby(key).min().to_numpy()
+
+    # Recombination node pairs are named after their (only) child
+    recomb_child = np.full(arg.num_nodes, -1)
+    recomb_child[parent[is_recomb[parent]]] = child[is_recomb[parent]]
+    names = np.where(is_recomb, "r" + recomb_child.astype(str), "n" + np.arange(arg.num_nodes).astype(str))
+    if np.any(is_recomb & (recomb_child < 0)):
+        raise ValueError("Recombination node without a child")
+
+    # One parent name per node (both recombination nodes above a node share one name)
+    parent_name = pd.Series(names[parent]).groupby(child).first()
+    above = np.full(arg.num_nodes, "", dtype=object)
+    above[parent_name.index] = parent_name.to_numpy()
+    if np.any(pd.Series(names[parent]).groupby(child).nunique() > 1):
+        raise ValueError("Node with more than one parent")
+
+    # Children of every named node
+    child_names = pd.DataFrame({"parent": names[parent], "child": names[child]}).drop_duplicates()
+    children = child_names.groupby("parent")["child"].agg(",".join)
+
+    plain = np.flatnonzero(~is_recomb)
+    nodes = pd.DataFrame({
+        "name": names[plain],
+        "event": np.where((arg.nodes_flags[plain] & 1) != 0, "gene", "coal"),
+        "age": arg.nodes_time[plain],
+        "pos": 0,
+        "parents": above[plain],
+    })
+
+    # Recombinations: the left node's links start at 0, the right one's at the breakpoint
+    recomb_links = np.flatnonzero(is_recomb[parent])
+    order = recomb_links[np.lexsort((left[recomb_links], child[recomb_links]))]
+    if len(order) % 2 or np.any(child[order[0::2]] != child[order[1::2]]):
+        raise ValueError("Recombination nodes are not in pairs")
+    left_node, right_node = parent[order[0::2]], parent[order[1::2]]
+    recombs = pd.DataFrame({
+        "name": names[left_node],
+        "event": "recomb",
+        "age": arg.nodes_time[left_node],
+        "pos": left[order[1::2]].astype(np.int64),
+        "parents": above[left_node] + "," + above[right_node],
+    })
+
+    table = pd.concat([nodes, recombs], ignore_index=True)
+    table["children"] = table["name"].map(children).fillna("")
+    with open(path, "w") as f:
+        f.write(f"start=0\tend={int(arg.sequence_length)}\n")
+        table.to_csv(f, sep="\t", index=False)
+    return len(table)
+
+
+def generate(outdir, samples, length, seed=1, map_spacing=1000):
+    """Write a dataset into outdir (unless already complete) and return its manifest."""
+    manifest_path = os.path.join(outdir, "manifest.json")
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    os.makedirs(outdir, exist_ok=True)
+    name = dataset_name(samples, length)
+    path = lambda suffix: os.path.join(outdir, f"{name}{suffix}")
+    rng = np.random.default_rng(seed)
+
+    arg, ts = simulate(samples, length, seed)
+    positions = ts.sites_position.astype(np.int64)
+    np.save(path(".positions.npy"), positions)
+    write_fasta(length, path(".fa"), rng)
+    manifest = {
+        "samples": samples,
+        "length": int(length),
+        "seed": seed,
+        "chrom": CHROM,
+        "files": {
+            "vcf": path(".vcf.gz"),
+            "afreq": path(".afreq"),
+            "hapmap": path(".hapmap"),
+            "arg": path(".arg"),
+            "fasta": path(".fa"),
+            "positions": path(".positions.npy"),
+        },
+        "rows": {
+            "vcf": write_vcf(ts, path(".vcf.gz")),
+            "afreq": write_afreq(ts, path(".afreq")),
+            "hapmap": write_hapmap(length, path(".hapmap"), map_spacing, rng),
+            "arg": write_arg(arg, path(".arg")),
+            "positions": len(positions),
+        },
+    }
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate one synthetic benchmark dataset with msprime.")
+    parser.add_argument("outdir", help="Output directory")
+    parser.add_argument("--samples", type=int, required=True, help="Diploid individuals")
+    parser.add_argument("--length", type=float, required=True, help="Region length in bp")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+    parser.add_argument("--map-spacing", type=int, default=1000,
+                        help="bp between recombination map rows (default: 1000)")
+    args = parser.parse_args()
+
+    manifest = generate(args.outdir, args.samples, args.length, args.seed, args.map_spacing)
+    print(json.dumps(manifest["rows"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Compare inferred ARGs with the simulated truth, in genomic windows.
+
+For one uid and one tool, the true ARG is loaded once per worker and every
+inferred sample (.trees files, or every sample of a .tsarchive) is compared
+with it in a process pool. Per window and sample the metrics are:
+
+- kc, rf: span-weighted mean Kendall-Colijn (lambda 0) and Robinson-Foulds
+  distances between the true and inferred local trees, over the parts of the
+  window where both have a single root;
+- tmrca_rmse, tmrca_abs_log10: error of the window-averaged TMRCA of a fixed
+  set of sample pairs (root mean square, and mean |log10(inferred / true)|);
+- mutation_age_abs_log10, num_sites: mean |log10(inferred / true)| age of the
+  oldest mutation at sites present in both ARGs, and how many sites that was.
+  Mutation times are used where known, otherwise the midpoint of the
+  mutation's branch. Both time metrics are nan for ARGs with uncalibrated
+  times (undated tsinfer output).
+
+Tree distances are computed on simplified copies (KC distance does not
+allow unary nodes, which tsinfer, Relate and Singer all produce), once per
+interval in which neither ARG changes tree, and integrated over windows with
+cumulative sums. The other metrics
+come from windowed tskit statistics. Inferred ARGs in region-relative
+coordinates (Singer) are shifted by --offset. Samples are matched by order.
+
+`compare` writes one Parquet table per uid and tool; `merge` concatenates
+them into one table per tool.
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import tskit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../shared/scripts"))
+from posterior_stats import choose_pairs, site_mutation_ages
+from stitch_trees import shifted_tables
+from trees_archive import TreesArchive
+
+COLUMNS = [
+    "uid", "tool", "sample", "window_start", "window_end", "kc", "rf",
+    "tmrca_rmse", "tmrca_abs_log10", "mutation_age_abs_log10", "num_sites",
+]
+
+# Set in each worker by init_worker: the true ARG and its precomputed statistics
+_truth = None
+
+
+def tree_view(ts):
+    """ts simplified for tree distances: samples renumbered 0..n-1 in order, unary nodes removed."""
+    return ts.simplify(ts.samples(), filter_sites=False)
+
+
+def align(ts, offset, sequence_length):
+    """Shift ts right by offset onto a sequence of sequence_length, cropping anything beyond it."""
+    end = sequence_length - offset
+    if ts.sequence_length > end:
+        tables = ts.dump_tables()
+        tables.keep_intervals([[0, end]], simplify=False)
+        tables.sequence_length = end
+        ts = tables.tree_sequence()
+    if offset or ts.sequence_length != sequence_length:
+        tables = shifted_tables(ts, offset, sequence_length)
+        ts = tables.tree_sequence()
+    return ts
+
+
+def site_ages(ts):
+    """Positions of sites with mutations and the age of each site's first mutation."""
+    position, age = site_mutation_ages(ts)
+    if len(position):
+        _, first = np.unique(ts.mutations_site, return_index=True)
+        known = ~tskit.is_unknown_time(ts.mutations_time[first])
+        age[known] = ts.mutations_time[first][known]
+    return position, age
+
+
+def window_tmrca(ts, pairs, windows):
+    """Window-averaged TMRCA of each pair (of sample indexes), shape (windows, pairs)."""
+    samples = ts.samples()
+    # tskit windows must cover [0, L]; pad around the region and drop the padding after
+    full = np.unique(np.concatenate([[0], windows, [ts.sequence_length]]))
+    first = np.searchsorted(full, windows[0])
+    return ts.divergence(
+        [[samples[u]] for u in pairs.ravel()],
+        indexes=[(2 * i, 2 * i + 1) for i in range(len(pairs))],
+        windows=full,
+        mode="branch",
+    )[first:first + len(windows) - 1] / 2
+
+
+def tree_distances(truth, inferred, start, end):
+    """Interval breakpoints within [start, end) and the KC and RF distance on each interval (nan if undefined)."""
+    breaks = np.union1d(truth.breakpoints(as_array=True), inferred.breakpoints(as_array=True))
+    breaks = np.concatenate([[start], breaks[(breaks > start) & (breaks < end)], [end]])
+    kc = np.full(len(breaks) - 1, np.nan)
+    rf = np.full(len(breaks) - 1, np.nan)
+    true_tree = truth.first(sample_lists=True)
+    inferred_tree = inferred.first(sample_lists=True)
+    for i, mid in enumerate((breaks[:-1] + breaks[1:]) / 2):
+        true_tree.seek(mid)
+        inferred_tree.seek(mid)
+        if true_tree.num_roots == 1 and inferred_tree.num_roots == 1:
+            kc[i] = true_tree.kc_distance(inferred_tree)
+            rf[i] = true_tree.rf_distance(inferred_tree)
+    return breaks, kc, rf
+
+
+def window_means(breaks, values, windows):
+    """Span-weighted mean of a piecewise-constant function (values on breaks) over each window, skipping nans."""
+    span = np.diff(breaks)
+    defined = np.isfinite(values)
+    integral = np.concatenate([[0], np.cumsum(np.where(defined, values, 0) * span)])
+    covered = np.concatenate([[0], np.cumsum(defined * span)])
+    total = np.diff(np.interp(windows, breaks, integral))
+    coverage = np.diff(np.interp(windows, breaks, covered))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(coverage > 0, total / coverage, np.nan)
+
+
+def init_worker(truth_path, windows, max_pairs):
+    global _truth
+    ts = tskit.load(truth_path)
+    pairs = choose_pairs(np.arange(ts.num_samples), max_pairs)
+    position, age = site_ages(ts)
+    _truth = {
+        "ts": ts,
+        "trees": tree_view(ts),
+        "windows": windows,
+        "pairs": pairs,
+        "tmrca": window_tmrca(ts, pairs, windows),
+        "site_position": position,
+        "site_age": age,
+    }
+
+
+def compare_sample(task):
+    """Metrics of one inferred sample against the worker's truth, one row per window."""
+    path, key, offset = task
+    if key is None:
+        inferred = tskit.load(path)
+    else:
+        inferred = TreesArchive(path)[key]
+    truth, windows, pairs = _truth["ts"], _truth["windows"], _truth["pairs"]
+    inferred = align(inferred, offset, truth.sequence_length)
+    if inferred.num_samples != truth.num_samples:
+        raise ValueError(f"{path}: {inferred.num_samples} samples, truth has {truth.num_samples}")
+
+    breaks, kc, rf = tree_distances(_truth["trees"], tree_view(inferred), windows[0], windows[-1])
+
+    true_tmrca = _truth["tmrca"]
+    calibrated = inferred.time_units != tskit.TIME_UNITS_UNCALIBRATED
+    tmrca = window_tmrca(inferred, pairs, windows) if calibrated else np.full_like(true_tmrca, np.nan)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        tmrca_rmse = np.sqrt(np.mean((tmrca - true_tmrca) ** 2, axis=1))
+        tmrca_log = np.mean(np.abs(np.log10(tmrca / true_tmrca)), axis=1)
+
+    position, age = site_ages(inferred) if calibrated else (np.empty(0), np.empty(0))
+    true_position, true_age = _truth["site_position"], _truth["site_age"]
+    index = np.searchsorted(true_position, position)
+    matched = index < len(true_position)
+    matched[matched] = true_position[index[matched]] == position[matched]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        log_error = np.abs(np.log10(age[matched] / true_age[index[matched]]))
+    valid = np.isfinite(log_error)
+    window = np.searchsorted(windows, position[matched][valid], side="right") - 1
+    inside = (window >= 0) & (window < len(windows) - 1)
+    num_sites = np.bincount(window[inside], minlength=len(windows) - 1)
+    error_sum = np.bincount(window[inside], weights=log_error[valid][inside], minlength=len(windows) - 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        age_error = np.where(num_sites > 0, error_sum / num_sites, np.nan)
+
+    return {
+        "window_start": windows[:-1],
+        "window_end": windows[1:],
+        "kc": window_means(breaks, kc, windows),
+        "rf": window_means(breaks, rf, windows),
+        "tmrca_rmse": tmrca_rmse,
+        "tmrca_abs_log10": tmrca_log,
+        "mutation_age_abs_log10": age_error,
+        "num_sites": num_sites,
+    }
+
+
+def inferred_tasks(paths, offset):
+    """(label, (path, archive key or None, offset)) for every inferred sample."""
+    tasks = []
+    for path in paths:
+        if path.endswith(".tsarchive"):
+            for label in TreesArchive(path).labels:
+                tasks.append((label, (path, label, offset)))
+        else:
+            tasks.append((os.path.basename(path).removesuffix(".trees"), (path, None, offset)))
+    return tasks
+
+
+def compare(truth_path, inferred_paths, uid, tool, window_size, start=None, end=None, offset=0,
+            workers=1, max_pairs=100):
+    """DataFrame of windowed metrics for every inferred sample of one uid and tool."""
+    if start is None or end is None:
+        sequence_length = tskit.load(truth_path).sequence_length
+        start = 0 if start is None else start
+        end = sequence_length if end is None else end
+    windows = np.unique(np.append(np.arange(start, end, window_size, dtype=float), end))
+    tasks = inferred_tasks(inferred_paths, offset)
+
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(truth_path, windows, max_pairs)) as pool:
+        results = list(pool.map(compare_sample, [task for _, task in tasks]))
+
+    frames = []
+    for (label, _), result in zip(tasks, results):
+        frame = pd.DataFrame(result)
+        frame.insert(0, "sample", label)
+        frames.append(frame)
+    table = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=COLUMNS[2:])
+    table.insert(0, "tool", tool)
+    table.insert(0, "uid", uid)
+    return table[COLUMNS]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Windowed comparison of inferred ARGs with the true ARG, written as Parquet tables."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("compare", help="Compare every inferred sample of one uid and tool with the truth")
+    run.add_argument("--truth", required=True, help="Simulated (true) .trees")
+    run.add_argument("--inferred", nargs="+", required=True, help="Inferred .trees or .tsarchive files")
+    run.add_argument("--uid", required=True, help="uid recorded in the table")
+    run.add_argument("--tool", required=True, help="Tool name recorded in the table")
+    run.add_argument("--window-size", type=float, default=1e6, help="Window size in bp (default: 1e6)")
+    run.add_argument("--start", type=float, default=None, help="Region start (default: 0)")
+    run.add_argument("--end", type=float, default=None, help="Region end (default: truth sequence length)")
+    run.add_argument("--offset", type=float, default=0,
+                     help="Shift applied to inferred coordinates, e.g. the region start for Singer (default: 0)")
+    run.add_argument("--max-pairs", type=int, default=100, help="Sample pairs used for TMRCA error (default: 100)")
+    run.add_argument("--workers", type=int, default=1, help="Worker processes (default: 1)")
+    run.add_argument("--out", required=True, help="Output .parquet")
+
+    merge = commands.add_parser("merge", help="Concatenate per-uid tables into one")
+    merge.add_argument("tables", nargs="+", help="Per-uid .parquet tables")
+    merge.add_argument("--out", required=True, help="Output .parquet")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        table = compare(args.truth, args.inferred, args.uid, args.tool, args.window_size, args.start,
+                        args.end, args.offset, args.workers, args.max_pairs)
+        print(f"{args.uid} {args.tool}: {table['sample'].nunique()} samples, {len(table)} rows")
+    else:
+        table = pd.concat([pd.read_parquet(path) for path in args.tables], ignore_index=True)
+    table.to_parquet(args.out, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Single-pass replacement for the normalize_vcf -> calculate_frequency ->
+pick_variants -> final_filtering chain.
+
+Multiallelic records are split into biallelic ones (other ALT alleles become
+REF, as with `bcftools norm -m -`), given CHROM:POS:REF:ALT IDs, and at each
+position the SNP with the highest ALT frequency that is not on the exclusion
+list is kept. Only the records at the current position are buffered. The
+output VCF carries GT only, like the plink2-recoded VCF it replaces, and is
+written uncompressed to stdout (or --out) so it can be piped into
+`bgzip` and `tabix`.
+"""
+
+import argparse
+import sys
+import numpy as np
+from cyvcf2 import VCF
+from variant_selector import load_exclusion_index, is_excluded
+
+# GT characters indexed by recoded allele + 1 (missing, REF, ALT)
+GT_CHARS = np.frombuffer(b".01", dtype=np.uint8)
+SNP_BASES = set("ACGTNacgtn")
+KEPT_HEADER_LINES = ("##fileformat=", "##contig=", "##reference=", "##FILTER=")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Split multiallelics, set CHROM:POS:REF:ALT IDs and keep the top-frequency "
+                    "biallelic SNP per position in one pass over a VCF."
+    )
+    parser.add_argument("vcf", help="Input (bgzipped) VCF.")
+    parser.add_argument("--out", default="-", help="Output VCF path (default: stdout).")
+    parser.add_argument("--exclusion_list", default="_NA",
+                        help="File of variant IDs to exclude (one per line). Default: _NA (no exclusion).")
+    parser.add_argument("--index_cache", default=None,
+                        help="File (.npy) caching the hashed exclusion list across runs. Default: none.")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Threads used by htslib for decompression (default: 1)")
+    return parser.parse_args()
+
+
+def write_header(out, vcf):
+    for line in vcf.raw_header.splitlines():
+        if line.startswith(KEPT_HEADER_LINES):
+            out.write(line + "\n")
+    out.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+    out.write("##source=fused_preprocess.py\n")
+    out.write("\t".join(["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + vcf.samples) + "\n")
+
+
+def alt_frequencies(alleles, num_alts):
+    """ALT allele frequencies over called alleles (as plink2 --freq after splitting)."""
+    called = alleles[alleles >= 0]
+    if len(called) == 0:
+        return np.full(num_alts, np.nan)
+    return np.bincount(called, minlength=num_alts + 1)[1:] / len(called)
+
+
+def format_genotypes(gt, alt_index):
+    """Tab-joined GT strings for the split record carrying ALT number alt_index."""
+    alleles, phased = gt[:, :-1], gt[:, -1]
+    recoded = np.where(alleles == alt_index, 1, np.where(alleles < 0, -1, 0))
+    if alleles.shape[1] == 2 and not np.any(alleles[:, 1] == -2):
+        cols = np.empty((len(gt), 4), dtype=np.uint8)
+        cols[:, 0] = GT_CHARS[recoded[:, 0] + 1]
+        cols[:, 1] = np.where(phased, ord("|"), ord("/"))
+        cols[:, 2] = GT_CHARS[recoded[:, 1] + 1]
+        cols[:, 3] = ord("\t")
+        return cols.tobytes()[:-1].decode()
+    # Mixed or non-diploid ploidy: -2 marks the end of a sample's alleles
+    return "\t".join(
+        ("|" if p else "/").join(".01"[a + 1] for a, raw in zip(row, raw_row) if raw != -2)
+        for row, raw_row, p in zip(recoded, alleles, phased)
+    )
+
+
+def write_record(out, best):
+    _, chrom, pos, ref, alt, qual, filt, gt, alt_index = best
+    out.write(
+        f"{chrom}\t{pos}\t{chrom}:{pos}:{ref}:{alt}\t{ref}\t{alt}\t{qual}\t{filt}\t.\tGT\t"
+        f"{format_genotypes(gt, alt_index)}\n"
+    )
+
+
+def fused_preprocess(vcf_file, out, exclusion_index=None, threads=1):
+    """Stream vcf_file into out; returns (records read, records written)."""
+    vcf = VCF(vcf_file, threads=threads)
+    write_header(out, vcf)
+
+    num_read = num_written = 0
+    key = best = None
+    for variant in vcf:
+        num_read += 1
+        if (variant.CHROM, variant.POS) != key:
+            if best is not None:
+                write_record(out, best)
+                num_written += 1
+            key, best = (variant.CHROM, variant.POS), None
+
+        ref, alts = variant.REF, variant.ALT
+        snps = [i for i, alt in enumerate(alts, start=1) if len(ref) == 1 and len(alt) == 1 and alt in SNP_BASES]
+        if not snps:
+            continue
+        gt = variant.genotype.array()
+        freqs = np.nan_to_num(alt_frequencies(gt[:, :-1].ravel(), len(alts)), nan=-1.0)
+        if exclusion_index is not None and len(exclusion_index):
+            # Exclusion IDs may use the VCF's contig name or plink2's (no "chr" prefix)
+            plink_chrom = variant.CHROM.removeprefix("chr")
+            ids = [f"{variant.CHROM}:{variant.POS}:{ref}:{alts[i - 1]}" for i in snps]
+            plink_ids = [f"{plink_chrom}:{variant.POS}:{ref}:{alts[i - 1]}" for i in snps]
+            excluded = is_excluded(ids, exclusion_index) | is_excluded(plink_ids, exclusion_index)
+            snps = [i for i, skip in zip(snps, excluded) if not skip]
+
+        for i in snps:
+            if best is None or freqs[i - 1] > best[0]:
+                qual = "." if variant.QUAL is None else f"{variant.QUAL:g}"
+                best = (freqs[i - 1], variant.CHROM, variant.POS, ref, alts[i - 1], qual,
+                        variant.FILTER or ".", gt, i)
+
+    if best is not None:
+        write_record(out, best)
+        num_written += 1
+    return num_read, num_written
+
+
+def main():
+    args = parse_args()
+    exclusion_index = None
+    if args.exclusion_list != "_NA":
+        exclusion_index = load_exclusion_index(args.exclusion_list, args.index_cache)
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w")
+    try:
+        num_read, num_written = fused_preprocess(args.vcf, out, exclusion_index, threads=args.threads)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Read {num_read} records, wrote {num_written} biallelic SNPs", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,149 @@
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
 import argparse
 import os
 
+# Bytes of the .afreq file parsed per record batch
+BLOCK_SIZE = 16 << 20
+
+
+def str_to_bool(value):
+    """Parse a command-line flag value such as True/False/1/0."""
+    return str(value).strip().lower() in ("true", "t", "yes", "y", "1")
+
+
+def hash_ids(ids):
+    """Hash variant IDs (Arrow array or sequence of str) to uint64, deterministically across processes."""
+    if isinstance(ids, (pa.Array, pa.ChunkedArray)):
+        ids = ids.to_numpy(zero_copy_only=False)
+    return pd.util.hash_array(np.asarray(ids, dtype=object))
+
+
+def load_exclusion_index(exclusion_list, cache_path=None):
+    """
+    Return the exclusion list as a sorted array of uint64 ID hashes.
+
+    With cache_path (a .npy file), the index is saved there and reused
+    (memory-mapped) by every chromosome until the list is modified.
+    """
+    if not os.path.exists(exclusion_list):
+        raise FileNotFoundError(
+            f"Exclusion list file not found at: {exclusion_list}"
+        )
+    if cache_path and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(exclusion_list):
+        return np.load(cache_path, mmap_mode="r")
+
+    # One ID per line (the whole stripped line); an empty list excludes nothing
+    with open(exclusion_list) as f:
+        ids = [line.strip() for line in f if line.strip()]
+    index = np.unique(hash_ids(ids)) if ids else np.empty(0, np.uint64)
+    if not cache_path:
+        return index
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp_path, index)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass  # read-only location: use the in-memory index
+    return index
+
+
+def is_excluded(ids, exclusion_index):
+    if not len(exclusion_index):
+        return np.zeros(len(ids), dtype=bool)
+    hashes = hash_ids(ids)
+    loc = np.minimum(np.searchsorted(exclusion_index, hashes), len(exclusion_index) - 1)
+    return exclusion_index[loc] == hashes
+
+
+def select_top_variants(allele_freq_file, outfile, exclusion_index=None, add_chr=True, block_size=BLOCK_SIZE):
+    """
+    Write the ID of the highest-ALT_FREQS variant at each chr:pos to outfile.
+
+    The .afreq file is streamed in record batches and must list each
+    chromosome as one block in position order (as plink2 writes it), so that
+    all variants at a position are adjacent; the last position of each batch
+    is carried over to the next. Ties keep the first variant. Returns the
+    number of IDs written.
+    """
+    reader = pacsv.open_csv(
+        allele_freq_file,
+        read_options=pacsv.ReadOptions(block_size=block_size),
+        parse_options=pacsv.ParseOptions(delimiter="\t"),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=["ID", "ALT_FREQS"],
+            column_types={"ID": pa.string(), "ALT_FREQS": pa.float64()},
+        ),
+    )
+    prefix = "chr" if add_chr else ""
+    finished_chroms = set()
+    current_chrom = None
+    carry = None
+    num_written = 0
+
+    with open(outfile, "w") as out:
+        for batch in reader:
+            table = pa.Table.from_batches([batch])
+            # Filter out excluded variants
+            if exclusion_index is not None and len(exclusion_index):
+                table = table.filter(pa.array(~is_excluded(table["ID"], exclusion_index)))
+            if carry is not None:
+                table = pa.concat_tables([carry, table])
+            if table.num_rows == 0:
+                continue
+
+            # ID format is expected to be CHR:POS:REF:ALT, splitting on ':'
+            parts = pc.split_pattern(table["ID"], ":", max_splits=2)
+            if pc.any(pc.less(pc.list_value_length(parts), 2)).as_py():
+                raise ValueError(f"Variant IDs must look like CHR:POS:REF:ALT in {allele_freq_file}")
+            chrom = pc.list_element(parts, 0)
+            pos = pc.cast(pc.list_element(parts, 1), pa.int64()).to_numpy()
+
+            same_chrom = np.empty(table.num_rows, dtype=bool)
+            same_chrom[0] = chrom[0].as_py() == current_chrom
+            same_chrom[1:] = pc.equal(chrom[1:], chrom[:-1]).to_numpy()
+            if np.any(same_chrom[1:] & (np.diff(pos) < 0)):
+                raise ValueError(f"{allele_freq_file} is not sorted by position")
+            for block_chrom in pc.take(chrom, np.flatnonzero(~same_chrom)).to_pylist():
+                if block_chrom in finished_chroms:
+                    raise ValueError(f"Chromosome {block_chrom} is not contiguous in {allele_freq_file}")
+                if current_chrom is not None:
+                    finished_chroms.add(current_chrom)
+                current_chrom = block_chrom
+
+            # Runs of rows sharing chr:pos; hold back the last run for the next batch
+            run_start = np.ones(table.num_rows, dtype=bool)
+            run_start[1:] = ~same_chrom[1:] | (pos[1:] != pos[:-1])
+            starts = np.flatnonzero(run_start)
+            carry = table.slice(starts[-1])
+            if len(starts) > 1:
+                num_written += write_top_variants(out, table.slice(0, starts[-1]), starts[:-1], prefix)
+
+        if carry is not None and carry.num_rows:
+            num_written += write_top_variants(out, carry, np.zeros(1, dtype=np.int64), prefix)
+
+    return num_written
+
+
+def write_top_variants(out, table, starts, prefix):
+    """Write the top variant (highest ALT_FREQS) of each run beginning at starts."""
+    freqs = np.nan_to_num(table["ALT_FREQS"].to_numpy(), nan=-1.0)
+    run_max = np.maximum.reduceat(freqs, starts)
+    run_id = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(freqs))))
+    is_max = np.flatnonzero(freqs == run_max[run_id])
+    _, first = np.unique(run_id[is_max], return_index=True)
+    ids = pc.take(table["ID"], is_max[first])
+    if prefix:
+        ids = pc.binary_join_element_wise(prefix, ids, "")
+    out.write("\n".join(ids.to_pylist()) + "\n")
+    return len(ids)
+
+
 def main():
     """
     Parses command-line arguments and selects variants based on allele frequency
@@ -11,55 +153,42 @@ def main():
     parser = argparse.ArgumentParser(
         description="Selects the variant with the highest allele frequency per unique chromosome:position and excludes specified variants."
     )
-    
+
     parser.add_argument("allele_freq_file", help="Path to the input allele frequency file (PLINK2 .afreq format).")
     parser.add_argument("outfile", help="Path to the output file (list of variant IDs to include).")
-    parser.add_argument("--add_chr", default = True, help = "add 'chr' before the variant ID")
+    parser.add_argument("--add_chr", default=True, type=str_to_bool, help = "add 'chr' before the variant ID")
     parser.add_argument("--exclusion_list", default="_NA",
                         help="Path to a file containing variant IDs to exclude (one ID per line). Default: _NA (no exclusion)."
     )
+    parser.add_argument("--index_cache", default=None,
+                        help="File (.npy) caching the hashed exclusion list across runs. Default: none (rebuilt each run).")
+    parser.add_argument("--block_size", default=BLOCK_SIZE, type=int,
+                        help=f"Bytes of the .afreq file processed at a time (default: {BLOCK_SIZE})")
     args = parser.parse_args()
 
     print(f"Reading allele frequency file: {args.allele_freq_file}")
     print(f"Writing variant inclusion list to: {args.outfile}")
     print(f"Exclusion list path: {args.exclusion_list}")
 
-    # 2. Read in list of variants to exclude
-    EXCLUSION_IDS = []
+    # 2. Load the (cached) index of variants to exclude
+    exclusion_index = None
     if args.exclusion_list != "_NA":
-        # Check if the exclusion file exists before attempting to open
-        if not os.path.exists(args.exclusion_list):
-             raise FileNotFoundError(
-                 f"Exclusion list file not found at: {args.exclusion_list}"
-             )
-        
-        with open(args.exclusion_list) as f:
-            EXCLUSION_IDS = [line.strip() for line in f if line.strip()]
-    
-    # 3. Process the allele frequency data
-    try:
-        # Read the .afreq file
-        afreq_df = pd.read_csv(args.allele_freq_file, sep="\t")
-    except FileNotFoundError:
-        # Re-raise the error with a more specific message if pandas fails
+        exclusion_index = load_exclusion_index(args.exclusion_list, args.index_cache)
+
+    if not os.path.exists(args.allele_freq_file):
         raise FileNotFoundError(
             f"Input allele frequency file not found or inaccessible: {args.allele_freq_file}"
         )
-    
-    # Filter out excluded variants
-    afreq_filtered = afreq_df.query("ID not in @EXCLUSION_IDS")
-    # Create the 'chr_pos' column for grouping
-    # ID format is expected to be CHR:POS:REF:ALT or similar, splitting on ':'
-    afreq_filtered["chr_pos"] = afreq_filtered["ID"].apply(lambda x: ":".join(str(x).split(":")[0:2]))
-    
-    # Select the top variant (highest ALT_FREQS) for each chr:pos
-    afreq_top_freq = (afreq_filtered.sort_values("ALT_FREQS", ascending=False).groupby("chr_pos", as_index=False).first())
-    
-    # 4. Write the output file
-    if args.add_chr:
-        afreq_top_freq["ID"] = afreq_top_freq["ID"].apply(lambda x : f"chr{x}") #add chr before variant id
-    afreq_top_freq["ID"].to_csv(args.outfile, sep=" ", index=False, header=False)
-    print(f"Created variant inclusion list with {len(afreq_top_freq)} variants.")
+
+    # 3. Stream the allele frequency data and write the output file
+    num_written = select_top_variants(
+        args.allele_freq_file,
+        args.outfile,
+        exclusion_index=exclusion_index,
+        add_chr=args.add_chr,
+        block_size=args.block_size,
+    )
+    print(f"Created variant inclusion list with {num_written} variants.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
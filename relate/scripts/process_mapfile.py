@@ -13,10 +13,14 @@ pos COMBINED_rate Genetic_Map
 """
 
 import argparse
+import os
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../shared/scripts"))
+from recomb_map import load_recomb_map, write_relate
 
-def convert_hapmap_to_relate(input_file, pos_col, rate_col, map_col, output_file=None):
+
+def convert_hapmap_to_relate(input_file, pos_col, rate_col, map_col, output_file=None, cache_dir=None):
     """
     Convert HapMap format to Relate format.
     
@@ -26,6 +30,7 @@ def convert_hapmap_to_relate(input_file, pos_col, rate_col, map_col, output_file
         rate_col: Column number for rate (0-indexed)
         map_col: Column number for genetic map (0-indexed)
         output_file: Path to output file (optional, defaults to input + .processed.relate)
+        cache_dir: Directory of parsed maps shared across runs (optional, see shared/scripts/recomb_map.py)
     """
     
     # If no output file specified, add .processed.relate to input filename
@@ -38,34 +43,8 @@ def convert_hapmap_to_relate(input_file, pos_col, rate_col, map_col, output_file
         else:
             output_file = output_file + '.processed.relate'
     
-    with open(input_file, 'r') as infile:
-        # Skip header
-        header = infile.readline().strip()
-        
-        # Write output file
-        with open(output_file, 'w') as outfile:
-            # Write Relate format header
-            outfile.write("pos COMBINED_rate Genetic_Map\n")
-            
-            # Process each line
-            for line in infile:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                cols = line.split()
-                
-                # Check if all required columns exist
-                max_col = max(pos_col, rate_col, map_col)
-                if len(cols) <= max_col:
-                    print(f"Warning: Skipping line with insufficient columns: {line}", file=sys.stderr)
-                    continue
-                
-                pos = cols[pos_col]
-                rate = cols[rate_col]
-                genetic_map = cols[map_col]
-                
-                outfile.write(f"{pos} {rate} {genetic_map}\n")
+    recomb_map = load_recomb_map(input_file, cache_dir, pos_col, rate_col, map_col)
+    write_relate(recomb_map, output_file)
     
     print(f"Conversion complete. Output written to: {output_file}")
 
@@ -119,6 +98,12 @@ Example usage:
         help='Column number for genetic map distance, 0-indexed (default: 3)'
     )
     
+    parser.add_argument(
+        '--cache-dir',
+        default=None,
+        help='Directory of parsed maps shared across runs (optional)'
+    )
+    
     args = parser.parse_args()
     
     try:
@@ -127,7 +112,8 @@ Example usage:
             args.pos,
             args.rate,
             args.map,
-            args.output
+            args.output,
+            args.cache_dir
         )
     except FileNotFoundError:
         print(f"Error: Input file '{args.input}' not found", file=sys.stderr)
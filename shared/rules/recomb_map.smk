@@ -0,0 +1,47 @@
+# Recombination map parsing shared by the workflows that read maps (relate, threads, tsinfer, argweaver)
+# and by the top-level Snakefile.
+#
+# Each distinct map of the params file is parsed once into RECOMB_MAP_CACHE by
+# recomb_map_cache (shared/scripts/recomb_map.py). Rules reading a map list
+# cached_recomb_map as an input, so uids (and, in the top-level workflow, tools)
+# sharing a map wait for that one parse instead of each parsing it on a cache miss.
+# The including Snakefile defines params, RECOMB_MAP_CACHE, SHARED_SCRIPTS and
+# SIZING, and has SHARED_SCRIPTS on sys.path.
+
+import os
+import re
+
+from recomb_map import map_digest
+
+# map path -> "{basename}.{digest}", the name of its parsed copy in the cache
+RECOMB_MAP_NAMES = {}
+if RECOMB_MAP_CACHE:
+    for _row in params.values():
+        _path = _row.get("recomb_map")
+        if _path and _path not in RECOMB_MAP_NAMES and os.path.exists(_path):
+            RECOMB_MAP_NAMES[_path] = f"{os.path.basename(_path)}.{map_digest(_path)}"
+RECOMB_MAPS = {name: path for path, name in RECOMB_MAP_NAMES.items()}
+
+def cached_recomb_map(wc):
+    """Parsed-map cache file of the uid's map (none without a cache or a map)."""
+    name = RECOMB_MAP_NAMES.get(params[wc.uid].get("recomb_map"))
+    return f"{RECOMB_MAP_CACHE}/{name}.npz" if name else []
+
+if RECOMB_MAPS:
+    rule recomb_map_cache:
+        input:
+            map_file=lambda wc: RECOMB_MAPS[wc.cached_map]
+        output:
+            f"{RECOMB_MAP_CACHE}/{{cached_map}}.npz"
+        wildcard_constraints:
+            cached_map="|".join(re.escape(name) for name in RECOMB_MAPS)
+        params:
+            script_path=os.path.join(SHARED_SCRIPTS, "recomb_map.py"),
+            cache_dir=RECOMB_MAP_CACHE
+        container: config.get("singularity")
+        resources: **SIZING.resources("recomb_map_cache")
+        benchmark: SIZING.benchmark("recomb_map_cache", "{cached_map}")
+        shell:
+            """
+            python {params.script_path} {input.map_file} --format cache --cache-dir {params.cache_dir}
+            """
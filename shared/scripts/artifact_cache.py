@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Content-addressed cache of intermediate conversions, shared across runs.
+
+A conversion step (a VCF to .vcz, .haps/.sample, .pgen or an extracted
+region) is keyed on the content of its input files, the content of the tools
+that run it (executables are resolved on PATH, so inside the container the
+container's binaries) and its parameters, not on uid or output_dir. Before
+building, a rule runs `fetch` with its outputs: on a hit the cached files are
+hard-linked into place and the step is skipped; on a miss it builds them and
+runs `store`, which links them into the cache. New output directories and
+params files therefore reuse every conversion whose inputs have not changed.
+Across filesystems outputs are symlinked instead, and break if their entry is
+later evicted, so keep the cache on the outputs' filesystem.
+
+Layout of the cache directory:
+
+- artifacts/{key}/: one entry, its outputs as 0, 1, ... (files or
+  directories) and manifest.json (step, output names, bytes). The
+  manifest's mtime is the entry's last use;
+- digests/: content hashes of inputs and tools, memoized by path, size and
+  mtime, so large VCFs are hashed once rather than on every lookup;
+- tmp/: entries being written, renamed into artifacts/ when complete.
+
+After each store the least recently used entries are removed until the
+cache fits in --max-size. Fetched files share their inode with the cache
+entry, so they are touched (for Snakemake's timestamps) but must not be
+rewritten in place. Adding or replacing files is safe: tsinfer's
+ancestral_state array, added to the .vcz, is written as new files.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import sys
+import time
+
+# Bytes read at a time when hashing a file
+HASH_CHUNK = 1 << 20
+
+SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+DEFAULT_MAX_SIZE = "100G"
+
+
+def parse_size(size):
+    """Bytes of a size such as 500M, 100G or 2T (binary units), or a plain byte count."""
+    text = str(size).strip().upper().removesuffix("B")
+    unit = text[-1:] if text[-1:] in SIZE_UNITS else ""
+    return int(float(text[:len(text) - len(unit)]) * SIZE_UNITS[unit])
+
+
+def file_digest(path, cache_dir):
+    """sha1 of a file's content, memoized under cache_dir/digests while its size and mtime are unchanged."""
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    stamp = [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+    memo = os.path.join(cache_dir, "digests", hashlib.sha1(path.encode()).hexdigest())
+    try:
+        with open(memo) as f:
+            saved = json.load(f)
+        if saved["stamp"] == stamp:
+            return saved["digest"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    os.makedirs(os.path.dirname(memo), exist_ok=True)
+    tmp_path = f"{memo}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"path": path, "stamp": stamp, "digest": digest.hexdigest()}, f)
+    os.replace(tmp_path, memo)
+    return digest.hexdigest()
+
+
+def resolve_tool(tool):
+    """Path of a tool: an existing file as given, else the executable found on PATH."""
+    if os.path.isfile(tool):
+        return tool
+    path = shutil.which(tool)
+    if path is None:
+        raise FileNotFoundError(f"Tool not found: {tool}")
+    return path
+
+
+def artifact_key(cache_dir, step, inputs, tools=(), params=()):
+    """Cache key of a step: its name, the content of its inputs and tools, and its KEY=VALUE params."""
+    digest = hashlib.sha1(f"step:{step}\n".encode())
+    for path in inputs:
+        digest.update(f"input:{file_digest(path, cache_dir)}\n".encode())
+    for tool in tools:
+        digest.update(f"tool:{tool}:{file_digest(resolve_tool(tool), cache_dir)}\n".encode())
+    for param in sorted(params):
+        digest.update(f"param:{param}\n".encode())
+    return digest.hexdigest()
+
+
+def tree_bytes(path):
+    """Size of a file, or of every file under a directory."""
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+    )
+
+
+def link_tree(source, target, fallback):
+    """
+    Hard-link a file, or every file of a directory tree, from source to target.
+
+    Where hard links are impossible (another filesystem), fallback(source,
+    target) is used for the whole file or directory instead.
+    """
+    try:
+        if os.path.isfile(source):
+            os.link(source, target)
+            return
+        for root, _, names in os.walk(source):
+            dest = os.path.join(target, os.path.relpath(root, source))
+            os.makedirs(dest, exist_ok=True)
+            for name in names:
+                os.link(os.path.join(root, name), os.path.join(dest, name))
+    except OSError:
+        remove(target)
+        fallback(source, target)
+
+
+def copy_tree(source, target):
+    if os.path.isfile(source):
+        shutil.copy2(source, target)
+    else:
+        shutil.copytree(source, target)
+
+
+def remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def touch(path):
+    """Set the mtime of a file, or of a directory and everything under it, to now."""
+    os.utime(path, follow_symlinks=False)
+    if os.path.isdir(path) and not os.path.islink(path):
+        for root, dirs, names in os.walk(path):
+            for name in dirs + names:
+                os.utime(os.path.join(root, name), follow_symlinks=False)
+
+
+def entry_path(cache_dir, key):
+    return os.path.join(cache_dir, "artifacts", key)
+
+
+def fetch(cache_dir, key, outputs):
+    """Link the cached outputs of key into place; False on a miss (outputs left absent)."""
+    entry = entry_path(cache_dir, key)
+    manifest = os.path.join(entry, "manifest.json")
+    try:
+        with open(manifest) as f:
+            if len(json.load(f)["outputs"]) != len(outputs):
+                return False
+        for i, output in enumerate(outputs):
+            remove(output)
+            os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+            link_tree(os.path.join(entry, str(i)), output, os.symlink)
+            touch(output)
+        os.utime(manifest)
+    except (OSError, ValueError, KeyError):
+        # Missing, or evicted while being linked
+        for output in outputs:
+            remove(output)
+        return False
+    return True
+
+
+def store(cache_dir, key, step, outputs, max_size):
+    """Add outputs to the cache as key's entry, then evict down to max_size; False if not stored."""
+    entry = entry_path(cache_dir, key)
+    if os.path.exists(entry):
+        return False
+    size = sum(tree_bytes(output) for output in outputs)
+    if size > max_size:
+        print(f"Not caching {step} ({size} bytes, above the {max_size}-byte cap)", file=sys.stderr)
+        return False
+
+    tmp = os.path.join(cache_dir, "tmp", f"{key}.{os.getpid()}")
+    remove(tmp)
+    os.makedirs(tmp)
+    try:
+        for i, output in enumerate(outputs):
+            link_tree(os.path.realpath(output), os.path.join(tmp, str(i)), copy_tree)
+        with open(os.path.join(tmp, "manifest.json"), "w") as f:
+            json.dump({"step": step, "outputs": [os.path.basename(o) for o in outputs],
+                       "bytes": size, "created": time.time()}, f)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # A concurrent job may have stored the same key first; either copy is the same
+        os.rename(tmp, entry)
+    except OSError:
+        remove(tmp)
+        return False
+    evict(cache_dir, max_size)
+    return True
+
+
+def entries(cache_dir):
+    """(last use, bytes, key, step) of every complete entry."""
+    root = os.path.join(cache_dir, "artifacts")
+    found = []
+    for key in os.listdir(root) if os.path.isdir(root) else []:
+        manifest = os.path.join(root, key, "manifest.json")
+        try:
+            with open(manifest) as f:
+                info = json.load(f)
+            found.append((os.path.getmtime(manifest), info["bytes"], key, info["step"]))
+        except (OSError, ValueError, KeyError):
+            continue
+    return found
+
+
+def evict(cache_dir, max_size):
+    """Remove least recently used entries until the cache holds at most max_size bytes; returns the number removed."""
+    found = sorted(entries(cache_dir))
+    total = sum(size for _, size, _, _ in found)
+    removed = 0
+    for _, size, key, _ in found:
+        if total <= max_size:
+            break
+        # Renamed first, so fetches see the entry whole or not at all
+        doomed = os.path.join(cache_dir, "tmp", f"{key}.evicted.{os.getpid()}")
+        try:
+            os.makedirs(os.path.dirname(doomed), exist_ok=True)
+            os.rename(entry_path(cache_dir, key), doomed)
+        except OSError:
+            continue  # already evicted by another job
+        shutil.rmtree(doomed, ignore_errors=True)
+        total -= size
+        removed += 1
+    return removed
+
+
+def report(cache_dir):
+    """Per step: entries and bytes, and the total."""
+    steps = {}
+    for _, size, _, step in entries(cache_dir):
+        count, total = steps.get(step, (0, 0))
+        steps[step] = (count + 1, total + size)
+    print("step\tentries\tbytes")
+    for step, (count, total) in sorted(steps.items()):
+        print(step, count, total, sep="\t")
+    print("total", sum(c for c, _ in steps.values()), sum(t for _, t in steps.values()), sep="\t")
+
+
+class ArtifactCache:
+    """
+    Cache arguments for the rules of one workflow (artifact_cache_dir and
+    artifact_cache_size in its config; no cache without a directory).
+    """
+
+    def __init__(self, config):
+        self.cache_dir = config.get("artifact_cache_dir") or ""
+        self.max_size = config.get("artifact_cache_size") or DEFAULT_MAX_SIZE
+
+    def options(self, step, inputs, tools=(), params=None):
+        """
+        Options of `fetch`/`store` for one step, as a params function of the
+        wildcards ("" without a cache, so fetch misses and store does nothing).
+
+        inputs(wildcards) returns the input files; tools are executables or
+        scripts; params is a dict (or a function of the wildcards returning one).
+        """
+        def options(wildcards):
+            if not self.cache_dir:
+                return ""
+            values = params(wildcards) if callable(params) else (params or {})
+            args = ["--cache-dir", self.cache_dir, "--max-size", self.max_size, "--step", step,
+                    "--inputs", *inputs(wildcards)]
+            if tools:
+                args += ["--tools", *tools]
+            if values:
+                args += ["--params", *(f"{name}={value}" for name, value in values.items())]
+            return " ".join(shlex.quote(str(arg)) for arg in args)
+        return options
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Content-addressed cache of intermediate conversions shared across runs."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    get = commands.add_parser("fetch", help="Link the step's cached outputs into place; exit 1 on a miss")
+    put = commands.add_parser("store", help="Add the step's outputs to the cache")
+    for sub in (get, put):
+        sub.add_argument("outputs", nargs="+", help="Output files or directories, in a fixed order")
+    for sub in (get, put):
+        sub.add_argument("--cache-dir", default=None, help="Cache directory (default: none; fetch misses)")
+        sub.add_argument("--step", default=None, help="Name of the conversion step")
+        sub.add_argument("--inputs", nargs="+", default=[], help="Input files, keyed on content")
+        sub.add_argument("--tools", nargs="+", default=[],
+                         help="Executables (found on PATH) or scripts that run the step, keyed on content")
+        sub.add_argument("--params", nargs="+", default=[], help="Step parameters as KEY=VALUE")
+        sub.add_argument("--max-size", default=DEFAULT_MAX_SIZE,
+                         help=f"Cache size cap, e.g. 500G (default: {DEFAULT_MAX_SIZE})")
+
+    trim = commands.add_parser("evict", help="Remove least recently used entries down to a size")
+    trim.add_argument("--cache-dir", required=True, help="Cache directory")
+    trim.add_argument("--max-size", required=True, help="Size to evict down to, e.g. 500G")
+    show = commands.add_parser("report", help="Print entries and bytes per step")
+    show.add_argument("--cache-dir", required=True, help="Cache directory")
+    args = parser.parse_args()
+
+    if args.command == "evict":
+        print(f"Evicted {evict(args.cache_dir, parse_size(args.max_size))} entries")
+        return
+    if args.command == "report":
+        report(args.cache_dir)
+        return
+    if not args.cache_dir:
+        sys.exit(0 if args.command == "store" else 1)
+    args.cache_dir = os.path.abspath(args.cache_dir)
+    if not args.step or not args.inputs:
+        parser.error("--step and --inputs are required with --cache-dir")
+
+    try:
+        key = artifact_key(args.cache_dir, args.step, args.inputs, args.tools, args.params)
+    except OSError as e:
+        # Without a key the step is built as if uncached
+        print(f"{args.step}: not cached ({e})", file=sys.stderr)
+        sys.exit(0 if args.command == "store" else 1)
+    if args.command == "fetch":
+        if not fetch(args.cache_dir, key, args.outputs):
+            sys.exit(1)
+        print(f"{args.step}: reused cached {key[:12]}")
+    elif store(args.cache_dir, key, args.step, args.outputs, parse_size(args.max_size)):
+        print(f"{args.step}: cached as {key[:12]}")
+
+
+if __name__ == "__main__":
+    main()
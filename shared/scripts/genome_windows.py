@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Split a genomic region into overlapping windows for sharded inference.
+
+The region [start, end) is tiled by core intervals of `size` bp; each window
+extends its core by `overlap` bp on either side (clipped to the region) so
+that inference near the core edges sees flanking data. Stitching keeps each
+window's tree sequence on its core only. Used by the Snakefiles (no
+dependencies beyond the standard library) and by stitch_trees.py.
+"""
+
+import argparse
+from collections import namedtuple
+
+Window = namedtuple("Window", ["start", "end", "core_start", "core_end"])
+
+
+def make_windows(start, end, size, overlap=0):
+    """Return the list of Window(start, end, core_start, core_end) covering [start, end)."""
+    start, end, size, overlap = int(start), int(end), int(size), int(overlap)
+    if end <= start:
+        raise ValueError(f"Empty region: start={start}, end={end}")
+    if size <= 0:
+        raise ValueError(f"Window size must be positive, got {size}")
+    if overlap < 0:
+        raise ValueError(f"Window overlap must be non-negative, got {overlap}")
+
+    windows = []
+    for core_start in range(start, end, size):
+        core_end = min(core_start + size, end)
+        windows.append(Window(
+            max(start, core_start - overlap),
+            min(end, core_end + overlap),
+            core_start,
+            core_end,
+        ))
+    return windows
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print the overlapping windows (start, end, core_start, core_end) tiling a region."
+    )
+    parser.add_argument("start", type=int, help="Region start")
+    parser.add_argument("end", type=int, help="Region end (exclusive)")
+    parser.add_argument("--size", type=int, required=True, help="Core window size in bp")
+    parser.add_argument("--overlap", type=int, default=0, help="Flank added to each side of a core (default: 0)")
+    args = parser.parse_args()
+
+    print("window\tstart\tend\tcore_start\tcore_end")
+    for i, window in enumerate(make_windows(args.start, args.end, args.size, args.overlap)):
+        print(i, *window, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Per-rule resource telemetry and job sizing for the workflows.
+
+Every rule writes a Snakemake benchmark file,
+{benchmark_dir}/{tool}/{rule}/{job}.tsv, with the job's wall time (s), CPU
+time, peak RSS (max_rss, MB) and I/O (io_in, io_out, MB). `fit` joins the
+benchmark files of a finished run with the input size of each job's uid
+(samples, sites, region length) and fits, per tool and rule, log-linear
+scaling models
+
+    log(y) = b0 + b1 log(samples) + b2 log(sites) + b3 log(length)
+
+of wall time, peak RSS and parallelism (CPU time / wall time). Observations
+accumulate in the models file, so each fit uses every run recorded so far.
+
+Workflows given the models file (`resource_models` in their config) size each
+job from its uid's inputs:
+
+- mem_mb and runtime (minutes): the prediction raised by the largest
+  under-prediction seen when fitting, times `resource_headroom`, and doubled
+  on each retry (run Snakemake with --retries);
+- threads: the predicted parallelism rounded up, never more than the rule's
+  configured thread count, so only rules that leave their threads idle shrink.
+
+Jobs that fetched their outputs from the artifact cache leave a marker
+(JobSizing.cache_hit) beside their benchmark file and are not fitted.
+
+Rules without a model keep their configured threads and Snakemake's default
+resources; jobs whose inputs cannot be measured get the largest values seen.
+Windows and chains are sized from their uid's inputs, as they are fitted.
+
+Input sizes are read with the standard library only, since Snakefiles import
+this module: the sample count from the VCF header, the site count from the
+.tbi/.csi index (its per-contig record counts, as `bcftools index -n`) and the
+length from the params row's start and end.
+"""
+
+import argparse
+import functools
+import glob
+import gzip
+import json
+import math
+import os
+import struct
+import sys
+
+FEATURES = ["samples", "sites", "length"]
+# Modelled benchmark quantity -> how it is read from a benchmark row
+METRICS = {
+    "runtime": lambda row: row["s"],
+    "mem": lambda row: row["max_rss"],
+    "parallelism": lambda row: row["cpu_time"] / row["s"] if row["s"] > 0 else float("nan"),
+}
+# Benchmark columns kept with each observation
+COLUMNS = ["s", "cpu_time", "max_rss", "io_in", "io_out"]
+# Marker beside the benchmark file of a job that reused cached outputs instead of running
+CACHE_HIT_SUFFIX = ".cache_hit"
+
+TABIX_PSEUDO_BIN = 37450
+
+
+def vcf_samples(vcf):
+    """Number of samples in the VCF header."""
+    opener = gzip.open if vcf.endswith(".gz") else open
+    with opener(vcf, "rt") as f:
+        for line in f:
+            if line.startswith("#CHROM"):
+                return max(0, len(line.rstrip("\n").split("\t")) - 9)
+            if not line.startswith("#"):
+                break
+    raise ValueError(f"No #CHROM header line in {vcf}")
+
+
+def indexed_sites(vcf):
+    """Records in the VCF according to its .tbi or .csi index, or None without an index."""
+    for suffix in (".csi", ".tbi"):
+        if os.path.exists(vcf + suffix):
+            with gzip.open(vcf + suffix, "rb") as f:
+                data = f.read()
+            break
+    else:
+        return None
+
+    magic = data[:4]
+    if magic == b"TBI\1":
+        n_ref, = struct.unpack_from("<i", data, 4)
+        l_nm, = struct.unpack_from("<i", data, 32)
+        offset = 36 + l_nm
+        pseudo_bin = TABIX_PSEUDO_BIN
+    elif magic == b"CSI\1":
+        _, depth, l_aux = struct.unpack_from("<3i", data, 4)
+        offset = 16 + l_aux
+        n_ref, = struct.unpack_from("<i", data, offset)
+        offset += 4
+        pseudo_bin = ((1 << ((depth + 1) * 3)) - 1) // 7 + 1
+    else:
+        raise ValueError(f"Unknown index format for {vcf}")
+
+    total = 0
+    for _ in range(n_ref):
+        n_bin, = struct.unpack_from("<i", data, offset)
+        offset += 4
+        for _ in range(n_bin):
+            bin_id, = struct.unpack_from("<I", data, offset)
+            offset += 4 if magic == b"TBI\1" else 12  # CSI bins also store a loffset
+            n_chunk, = struct.unpack_from("<i", data, offset)
+            offset += 4
+            if bin_id == pseudo_bin:
+                # Second chunk of the pseudo-bin: mapped and unmapped record counts
+                n_mapped, = struct.unpack_from("<Q", data, offset + 16)
+                total += n_mapped
+            offset += 16 * n_chunk
+        if magic == b"TBI\1":
+            n_intv, = struct.unpack_from("<i", data, offset)
+            offset += 4 + 8 * n_intv
+    return total
+
+
+@functools.lru_cache(maxsize=None)
+def input_features(vcf, start=None, end=None):
+    """Input size of a region: samples and (indexed) sites of its VCF, and end - start when both are set."""
+    length = None
+    if start not in (None, "") and end not in (None, ""):
+        length = int(float(end)) - int(float(start))
+    return {"samples": vcf_samples(vcf), "sites": indexed_sites(vcf), "length": length}
+
+
+def load_models(path):
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"version": 1, "observations": {}, "models": {}}
+
+
+def predict(model, features):
+    """
+    Model predictions {metric: value} for one job's features; without features
+    (or missing one the model uses), the largest value observed when fitting.
+    """
+    if features is None or any(features.get(name) is None for name in model["features"]):
+        return {metric: fit["max"] for metric, fit in model["metrics"].items()}
+    x = [1.0] + [math.log(max(float(features[name]), 1.0)) for name in model["features"]]
+    return {
+        metric: math.exp(sum(b * v for b, v in zip(fit["coef"], x)) + fit["margin"])
+        for metric, fit in model["metrics"].items()
+    }
+
+
+class JobSizing:
+    """
+    Benchmark paths, threads and resources for the rules of one workflow.
+
+    job_features(wildcards) returns the input features of a job (usually
+    input_features of its uid's params row); jobs it fails for get each
+    model's largest observed values.
+    """
+
+    def __init__(self, tool, config, output_dir, job_features):
+        self.tool = tool
+        self.benchmark_dir = config.get("benchmark_dir") or f"{output_dir}/benchmarks"
+        self.models = load_models(config.get("resource_models") or "")["models"].get(tool, {})
+        self.headroom = float(config.get("resource_headroom", 1.2))
+        self.job_features = job_features
+
+    def benchmark(self, rule, job="{uid}"):
+        """Benchmark file of a rule's job; job is a pattern of the rule's wildcards."""
+        return f"{self.benchmark_dir}/{self.tool}/{rule}/{job}.tsv"
+
+    def cache_hit(self, rule, job="{uid}"):
+        """Marker file beside a job's benchmark, touched by rules when they fetch from the artifact cache."""
+        return self.benchmark(rule, job) + CACHE_HIT_SUFFIX
+
+    def _predict(self, rule, wildcards):
+        try:
+            features = self.job_features(wildcards)
+        except (AttributeError, KeyError, OSError, ValueError):
+            features = None
+        return predict(self.models[rule], features)
+
+    def threads(self, rule, default):
+        """Thread count of a rule: default, or with a model, the predicted parallelism up to default."""
+        default = max(1, int(default))
+        if rule not in self.models:
+            return default
+
+        def threads(wildcards):
+            predicted = self._predict(rule, wildcards)
+            return min(default, max(1, math.ceil(predicted["parallelism"])))
+        return threads
+
+    def resources(self, rule):
+        """mem_mb and runtime of a rule from its model (empty without one, leaving Snakemake's defaults)."""
+        if rule not in self.models:
+            return {}
+
+        def sized(metric, scale, minimum):
+            def resource(wildcards, attempt):
+                predicted = self._predict(rule, wildcards)
+                return max(minimum, math.ceil(predicted[metric] * scale * self.headroom)) * 2 ** (attempt - 1)
+            return resource
+
+        return {"mem_mb": sized("mem", 1, 100), "runtime": sized("runtime", 1 / 60, 1)}
+
+
+def read_benchmark(path):
+    """Mean of each column over the rows (repeats) of a Snakemake benchmark file; nan where missing."""
+    with open(path) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        rows = [line.rstrip("\n").split("\t") for line in f if line.strip()]
+    values = {}
+    for column in COLUMNS:
+        numbers = []
+        for row in rows:
+            try:
+                numbers.append(float(row[header.index(column)]))
+            except (ValueError, IndexError):
+                pass
+        values[column] = sum(numbers) / len(numbers) if numbers else float("nan")
+    return values
+
+
+def job_regions(params_file=None, vcfs=()):
+    """Job-name prefix -> (vcf, start, end): params rows by uid, or VCFs by base name (preprocessing)."""
+    regions = {}
+    if params_file:
+        import csv
+
+        with open(params_file) as f:
+            for row in csv.DictReader(f):
+                regions[row["uid"]] = (row["vcf_file"], row.get("start"), row.get("end"))
+    for vcf in vcfs:
+        name = os.path.basename(vcf).replace(".vcf.gz", "").replace(".vcf", "")
+        regions[name] = (vcf, None, None)
+    return regions
+
+
+def observe(models, tool, benchmark_dir, regions):
+    """Add the tool's benchmark files to models["observations"]; returns how many were added."""
+    # Longest prefix first, so uid "a.1" wins over "a" for job "a.1.w0"
+    names = sorted(regions, key=len, reverse=True)
+    added = 0
+    for path in sorted(glob.glob(os.path.join(benchmark_dir, tool, "*", "*.tsv"))):
+        rule = os.path.basename(os.path.dirname(path))
+        job = os.path.basename(path).removesuffix(".tsv")
+        name = next((n for n in names if job == n or job.startswith(n + ".")), None)
+        # Cache hits took seconds whatever the input size, so they would skew the fit
+        if name is None or os.path.exists(path + CACHE_HIT_SUFFIX):
+            continue
+        try:
+            features = input_features(*regions[name])
+        except (OSError, ValueError) as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+            continue
+        key = "/".join([tool, rule, job] + [str(features[f]) for f in FEATURES])
+        models["observations"][key] = {"tool": tool, "rule": rule, "job": job, **features,
+                                       **read_benchmark(path)}
+        added += 1
+    return added
+
+
+def fit_models(observations):
+    """{tool: {rule: model}} from the observations; see the module docstring for the model."""
+    import numpy as np
+    import pandas as pd
+
+    table = pd.DataFrame(list(observations.values()))
+    models = {}
+    for (tool, rule), group in table.groupby(["tool", "rule"]):
+        # Features every job of the rule has, and that vary (a constant one is the intercept's)
+        features = [f for f in FEATURES if group[f].notna().all() and group[f].nunique() > 1]
+        x = np.column_stack([np.ones(len(group))] + [np.log(np.maximum(group[f].astype(float), 1)) for f in features])
+        fits = {}
+        for metric, value in METRICS.items():
+            y = group.apply(value, axis=1).astype(float).to_numpy()
+            keep = np.isfinite(y) & (y > 0)
+            if not keep.any():
+                continue
+            xm, ym = x[keep], np.log(y[keep])
+            # Too few jobs for the slopes: a constant, the largest observed value
+            if keep.sum() <= len(features) + 1:
+                xm = xm[:, :1]
+            coef = np.linalg.lstsq(xm, ym, rcond=None)[0]
+            coef = np.concatenate([coef, np.zeros(x.shape[1] - len(coef))])
+            margin = float(max(0.0, np.max(ym - x[keep] @ coef)))
+            fits[metric] = {"coef": coef.tolist(), "margin": margin, "max": float(np.max(y[keep])),
+                            "jobs": int(keep.sum())}
+        if {"runtime", "mem", "parallelism"} <= fits.keys():
+            models.setdefault(tool, {})[rule] = {"features": features, "metrics": fits}
+    return models
+
+
+def report(models):
+    """Per tool and rule: jobs, median wall/CPU time, peak RSS and I/O, and the fitted exponents."""
+    observations = list(models["observations"].values())
+    print("tool\trule\tjobs\ts\tcpu_time\tmax_rss\tio_in\tio_out\texponents")
+    groups = {}
+    for obs in observations:
+        groups.setdefault((obs["tool"], obs["rule"]), []).append(obs)
+    for (tool, rule), group in sorted(groups.items()):
+        medians = []
+        for column in COLUMNS:
+            values = sorted(obs[column] for obs in group if not math.isnan(obs[column]))
+            medians.append(f"{values[len(values) // 2]:.4g}" if values else "NA")
+        model = models["models"].get(tool, {}).get(rule)
+        exponents = ""
+        if model:
+            exponents = " ".join(
+                f"{metric}:" + ",".join(f"{name}^{b:.2f}" for name, b in zip(model["features"], fit["coef"][1:]))
+                for metric, fit in model["metrics"].items()
+            )
+        print(tool, rule, len(group), *medians, exponents, sep="\t")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit per-rule resource models from Snakemake benchmark files, or summarize them."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fit = commands.add_parser("fit", help="Add a run's benchmark files to the models file and refit")
+    fit.add_argument("--models", required=True, help="Models file (.json), created if missing")
+    fit.add_argument("--tool", required=True, help="Workflow name, e.g. tsinfer (subdirectory of --benchmark-dir)")
+    fit.add_argument("--benchmark-dir", required=True, help="The workflow's benchmark_dir")
+    fit.add_argument("--params", default=None, help="Params CSV of the run (uid, vcf_file, start, end)")
+    fit.add_argument("--vcfs", nargs="+", default=[], help="Input VCFs, for workflows without a params CSV")
+
+    show = commands.add_parser("report", help="Print telemetry summaries and fitted exponents")
+    show.add_argument("--models", required=True, help="Models file (.json)")
+    args = parser.parse_args()
+
+    if args.command == "fit":
+        if not args.params and not args.vcfs:
+            parser.error("fit needs --params or --vcfs")
+        models = load_models(args.models)
+        added = observe(models, args.tool, args.benchmark_dir, job_regions(args.params, args.vcfs))
+        models["models"] = fit_models(models["observations"]) if models["observations"] else {}
+        tmp_path = f"{args.models}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(models, f, indent=1)
+        os.replace(tmp_path, args.models)
+        fitted = sum(len(rules) for rules in models["models"].values())
+        print(f"Added {added} {args.tool} jobs; {len(models['observations'])} jobs, {fitted} rule models")
+    else:
+        report(load_models(args.models))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Running posterior summaries of MCMC tree sequence samples.
+
+Each sample is folded into a small state file (.npz) and can then be deleted,
+so statistics cover every MCMC iteration without keeping every .trees file.
+The state holds fixed-size arrays, sized when it is created:
+
+- diversity: branch-mode diversity per genomic window (running mean/variance);
+- tmrca_hist: span-weighted histogram of pairwise TMRCAs per window, over up
+  to max_pairs sample pairs fixed at creation;
+- coal_rate: pair coalescence rates per window and time bin (running
+  mean/variance; cells without coalescences are skipped);
+- mutation_age: age of the oldest mutation at each site of the first sample,
+  taken as the midpoint of its branch (running mean/variance; later samples'
+  sites are matched by position).
+
+Running moments use Welford's update: *_count, *_mean and *_m2 arrays, with
+variance m2 / (count - 1). Updates take an exclusive lock on <state>.lock, so
+concurrent conversion jobs can share a state file, and each label (iteration)
+is only folded in once, so reruns do not double count.
+"""
+
+import argparse
+import fcntl
+import os
+
+import numpy as np
+import tskit
+
+# Moment statistics kept as <name>_count, <name>_mean, <name>_m2
+MOMENTS = ["diversity", "coal_rate", "mutation_age"]
+
+
+def time_edges(num_bins, min_time, max_time):
+    """Time bin edges: 0, num_bins - 1 log-spaced edges from min_time to max_time, inf."""
+    return np.concatenate([[0.0], np.geomspace(min_time, max_time, num_bins - 1), [np.inf]])
+
+
+def choose_pairs(samples, max_pairs, seed=1):
+    """Up to max_pairs distinct sample pairs, chosen reproducibly."""
+    samples = np.asarray(samples)
+    pairs = np.array([(a, b) for i, a in enumerate(samples) for b in samples[i + 1:]], dtype=np.int32)
+    if len(pairs) > max_pairs:
+        rng = np.random.default_rng(seed)
+        pairs = pairs[np.sort(rng.choice(len(pairs), max_pairs, replace=False))]
+    return pairs.reshape(-1, 2)
+
+
+def new_state(ts, window_size, num_time_bins=20, min_time=100, max_time=1e6, max_pairs=100):
+    """Empty state sized from the first sample ts."""
+    num_windows = int(np.ceil(ts.sequence_length / window_size))
+    windows = np.minimum(np.arange(num_windows + 1) * float(window_size), ts.sequence_length)
+    times = time_edges(num_time_bins, min_time, max_time)
+    site_position = ts.sites_position.copy()
+    state = {
+        "windows": windows,
+        "time_edges": times,
+        "pairs": choose_pairs(ts.samples(), max_pairs),
+        "site_position": site_position,
+        "labels": np.array([], dtype=str),
+        "tmrca_hist": np.zeros((num_windows, num_time_bins)),
+    }
+    shapes = {
+        "diversity": (num_windows,),
+        "coal_rate": (num_windows, num_time_bins),
+        "mutation_age": (len(site_position),),
+    }
+    for name, shape in shapes.items():
+        state[f"{name}_count"] = np.zeros(shape, dtype=np.int64)
+        state[f"{name}_mean"] = np.zeros(shape)
+        state[f"{name}_m2"] = np.zeros(shape)
+    return state
+
+
+def welford(state, name, values, valid=None):
+    """Fold values into the running moments of name, for cells where valid (and values are finite)."""
+    valid = np.isfinite(values) if valid is None else valid & np.isfinite(values)
+    count = state[f"{name}_count"]
+    mean = state[f"{name}_mean"]
+    count[valid] += 1
+    delta = values[valid] - mean[valid]
+    mean[valid] += delta / count[valid]
+    state[f"{name}_m2"][valid] += delta * (values[valid] - mean[valid])
+
+
+def site_mutation_ages(ts):
+    """
+    Positions of sites with mutations and the branch-midpoint age of each site's
+    first (oldest) mutation; mutations above a root get the node's own time.
+    """
+    if ts.num_mutations == 0:
+        return np.empty(0), np.empty(0)
+    sites, first = np.unique(ts.mutations_site, return_index=True)
+    node = ts.mutations_node[first]
+    position = ts.sites_position[sites]
+
+    # The edge above each mutation: the edge whose child is node and whose [left, right) covers position
+    lefts = np.unique(ts.edges_left)
+    stride = len(lefts) + 1
+    edge_keys = ts.edges_child.astype(np.int64) * stride + np.searchsorted(lefts, ts.edges_left)
+    order = np.argsort(edge_keys, kind="stable")
+    query = node.astype(np.int64) * stride + np.searchsorted(lefts, position, side="right") - 1
+    edge = order[np.maximum(np.searchsorted(edge_keys[order], query, side="right") - 1, 0)]
+    above = (
+        (ts.edges_child[edge] == node)
+        & (ts.edges_left[edge] <= position)
+        & (position < ts.edges_right[edge])
+    )
+    node_time = ts.nodes_time[node]
+    parent_time = np.where(above, ts.nodes_time[ts.edges_parent[edge]], node_time)
+    return position, (node_time + parent_time) / 2
+
+
+def update_state(state, ts, label):
+    """Fold tree sequence ts into state; returns False if label was already included."""
+    if str(label) in state["labels"]:
+        return False
+    windows = state["windows"]
+    if ts.sequence_length != windows[-1]:
+        raise ValueError(f"Sample {label} has sequence length {ts.sequence_length}, state has {windows[-1]}")
+    times = state["time_edges"]
+
+    welford(state, "diversity", ts.diversity(windows=windows, mode="branch"))
+
+    pairs = state["pairs"]
+    if len(pairs):
+        tmrca = ts.divergence(
+            [[u] for u in pairs.ravel()],
+            indexes=[(2 * i, 2 * i + 1) for i in range(len(pairs))],
+            windows=windows,
+            mode="branch",
+        ) / 2
+        span = np.diff(windows)
+        bins = np.clip(np.searchsorted(times, tmrca, side="right") - 1, 0, len(times) - 2)
+        window_index = np.broadcast_to(np.arange(len(span))[:, None], bins.shape)
+        np.add.at(state["tmrca_hist"], (window_index, bins), span[window_index])
+
+    rates = ts.pair_coalescence_rates(time_windows=times, windows=windows)
+    welford(state, "coal_rate", np.asarray(rates).reshape(state["coal_rate_mean"].shape))
+
+    position, age = site_mutation_ages(ts)
+    site_position = state["site_position"]
+    index = np.searchsorted(site_position, position)
+    matched = index < len(site_position)
+    matched[matched] = site_position[index[matched]] == position[matched]
+    ages = np.full(len(site_position), np.nan)
+    ages[index[matched]] = age[matched]
+    welford(state, "mutation_age", ages)
+
+    state["labels"] = np.append(state["labels"], str(label))
+    return True
+
+
+def load_state(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def save_state(state, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, **state)
+    os.replace(tmp_path, path)
+
+
+def update_file(path, trees, label, remove=False, **options):
+    """
+    Fold a .trees file into the state at path (created from it if missing),
+    holding the state's lock. options size a new state (see new_state).
+    """
+    ts = tskit.load(trees)
+    with open(f"{path}.lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = load_state(path) if os.path.exists(path) else new_state(ts, **options)
+        if update_state(state, ts, label):
+            save_state(state, path)
+    if remove:
+        os.remove(trees)
+
+
+def summary(state):
+    """Mean and variance arrays of every moment statistic, plus the TMRCA histogram."""
+    out = {"windows": state["windows"], "time_edges": state["time_edges"],
+           "num_samples": len(state["labels"]), "tmrca_hist": state["tmrca_hist"]}
+    for name in MOMENTS:
+        count = state[f"{name}_count"]
+        out[f"{name}_mean"] = np.where(count > 0, state[f"{name}_mean"], np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[f"{name}_var"] = np.where(count > 1, state[f"{name}_m2"] / (count - 1), np.nan)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fold MCMC tree sequence samples into running posterior summaries, or print them."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    update = commands.add_parser("update", help="Fold .trees samples into a state file")
+    update.add_argument("state", help="State .npz (created from the first sample if missing)")
+    update.add_argument("trees", nargs="+", help=".trees samples")
+    update.add_argument("--labels", nargs="+", default=None,
+                        help="Sample labels, e.g. iterations (default: file names without .trees)")
+    update.add_argument("--remove", action="store_true", help="Delete each .trees file once folded in")
+    update.add_argument("--window-size", type=float, default=1e6, help="Genomic window size (default: 1e6)")
+    update.add_argument("--time-bins", type=int, default=20, help="Number of time bins (default: 20)")
+    update.add_argument("--min-time", type=float, default=100, help="First non-zero time bin edge (default: 100)")
+    update.add_argument("--max-time", type=float, default=1e6, help="Last finite time bin edge (default: 1e6)")
+    update.add_argument("--max-pairs", type=int, default=100,
+                        help="Sample pairs tracked for the TMRCA histogram (default: 100)")
+
+    show = commands.add_parser("summary", help="Print per-window posterior means and standard deviations")
+    show.add_argument("state", help="State .npz")
+    args = parser.parse_args()
+
+    if args.command == "update":
+        if args.labels is not None and len(args.labels) != len(args.trees):
+            parser.error("--labels needs one label per .trees file")
+        labels = args.labels or [os.path.basename(path).removesuffix(".trees") for path in args.trees]
+        for path, label in zip(args.trees, labels):
+            update_file(args.state, path, label, args.remove, window_size=args.window_size,
+                        num_time_bins=args.time_bins, min_time=args.min_time, max_time=args.max_time,
+                        max_pairs=args.max_pairs)
+    else:
+        stats = summary(load_state(args.state))
+        windows = stats["windows"]
+        tmrca_total = stats["tmrca_hist"].sum(axis=1, keepdims=True)
+        # Time bin holding each window's median pairwise TMRCA
+        with np.errstate(invalid="ignore"):
+            cdf = np.cumsum(stats["tmrca_hist"], axis=1) / tmrca_total
+        median_bin = np.argmax(cdf >= 0.5, axis=1)
+        print(f"# {stats['num_samples']} samples")
+        print("start\tend\tdiversity_mean\tdiversity_sd\ttmrca_median_bin_start\ttmrca_median_bin_end")
+        for i in range(len(windows) - 1):
+            print(windows[i], windows[i + 1],
+                  f"{stats['diversity_mean'][i]:.6g}", f"{np.sqrt(stats['diversity_var'][i]):.6g}",
+                  stats["time_edges"][median_bin[i]], stats["time_edges"][median_bin[i] + 1], sep="\t")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Parse HapMap recombination maps once and emit every tool's map format.
+
+HapMap format example:
+Chromosome  Position(bp)  Rate(cM/Mb)  Map(cM)
+chr17       550394445     0.004866000  0.000000000
+
+A parsed map is cached as an uncompressed .npz keyed on the map's content,
+so the hundreds of uids that share a map parse its text only once. The cache
+holds the contig name, position/rate/genetic-map arrays and the original text
+of those three columns, so the Relate and THReaD-S forms are written as
+byte copies (values exactly as in the input) while the ARG-Needle (PLINK
+.map) and ArgWeaver forms and msprime RateMaps use the arrays.
+"""
+
+import argparse
+import hashlib
+import os
+from collections import namedtuple
+
+import numpy as np
+
+# rows: b"pos rate cm\n" for every map line, as in the input
+RecombMap = namedtuple("RecombMap", ["chrom", "position", "rate", "cm", "rows"])
+
+FORMATS = ["relate", "threads", "argneedle", "argweaver", "cache"]
+
+# Bytes read at a time when hashing a map file
+HASH_CHUNK = 1 << 20
+
+
+def map_digest(map_file, pos_col=1, rate_col=2, map_col=3):
+    """Hash of the map's content and the columns read from it."""
+    digest = hashlib.sha1(f"{pos_col}:{rate_col}:{map_col}:".encode())
+    with open(map_file, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+def parse_hapmap(map_file, pos_col=1, rate_col=2, map_col=3):
+    """
+    Parse a whitespace-delimited HapMap file (one contig, one header line).
+
+    The genetic map column is optional: if the file has fewer columns it is
+    computed from the rates.
+    """
+    # pandas is only needed on a cache miss; cached loads skip the import
+    import pandas as pd
+
+    table = pd.read_csv(map_file, sep=r"\s+", header=None, skiprows=1, dtype=str)
+    if table.shape[1] <= max(pos_col, rate_col):
+        raise ValueError(f"{map_file} has {table.shape[1]} columns; need position and rate columns")
+    if len(table) == 0:
+        raise ValueError(f"Empty recombination map: {map_file}")
+
+    position = table[pos_col].astype(np.int64).to_numpy()
+    rate = table[rate_col].astype(np.float64).to_numpy()
+    if map_col < table.shape[1]:
+        cm_text = table[map_col]
+        cm = cm_text.astype(np.float64).to_numpy()
+    else:
+        cm = np.concatenate([[0.0], np.cumsum(rate[:-1] * np.diff(position) / 1e6)])
+        cm_text = pd.Series(cm).astype(str)
+    if np.any(np.diff(position) <= 0):
+        raise ValueError(f"Positions in {map_file} are not strictly increasing")
+    rows = (table[pos_col] + " " + table[rate_col] + " " + cm_text + "\n").str.cat().encode()
+    return RecombMap(str(table[0].iloc[0]), position, rate, cm, rows)
+
+
+def load_recomb_map(map_file, cache_dir=None, pos_col=1, rate_col=2, map_col=3):
+    """
+    Return the parsed map, reading <cache_dir>/<name>.<digest>.npz if present.
+
+    Without cache_dir the text is parsed every time.
+    """
+    if not cache_dir:
+        return parse_hapmap(map_file, pos_col, rate_col, map_col)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    digest = map_digest(map_file, pos_col, rate_col, map_col)
+    cache_path = os.path.join(cache_dir, f"{os.path.basename(map_file)}.{digest}.npz")
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            return RecombMap(str(cached["chrom"]), cached["position"], cached["rate"], cached["cm"],
+                             cached["rows"].tobytes())
+
+    recomb_map = parse_hapmap(map_file, pos_col, rate_col, map_col)
+    # Concurrent jobs sharing a map each write their own temp file; the rename is atomic.
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_path, chrom=np.array(recomb_map.chrom), position=recomb_map.position,
+             rate=recomb_map.rate, cm=recomb_map.cm,
+             rows=np.frombuffer(recomb_map.rows, dtype=np.uint8))
+    os.replace(tmp_path, cache_path)
+    return recomb_map
+
+
+def write_relate(recomb_map, out):
+    """Relate genetic map: pos COMBINED_rate Genetic_Map."""
+    with open(out, "wb") as f:
+        f.write(b"pos COMBINED_rate Genetic_Map\n")
+        f.write(recomb_map.rows)
+
+
+def write_threads(recomb_map, out):
+    """THReaD-S genetic map: the HapMap columns under a chr/pos/rate/cM header."""
+    prefix = recomb_map.chrom.encode() + b"\t"
+    body = recomb_map.rows[:-1].replace(b" ", b"\t").replace(b"\n", b"\n" + prefix)
+    with open(out, "wb") as f:
+        f.write(b"chr\tpos\trate\tcM\n")
+        f.write(prefix + body + b"\n")
+
+
+def genetic_positions(recomb_map, positions):
+    """Genetic map position (cM) of each bp position, linearly interpolated."""
+    return np.interp(positions, recomb_map.position, recomb_map.cm)
+
+
+def write_plink_map(recomb_map, haps_file, out):
+    """ARG-Needle (PLINK .map) for the SNPs of a .haps file: chrom, id, cM, bp."""
+    import pandas as pd
+
+    snps = pd.read_csv(haps_file, sep=" ", header=None, usecols=[0, 1, 2], dtype={0: str, 1: str})
+    with open(out, "w") as f:
+        pd.DataFrame({
+            "chrom": snps[0],
+            "id": snps[1],
+            "cm": genetic_positions(recomb_map, snps[2].to_numpy()),
+            "pos": snps[2],
+        }).to_csv(f, sep="\t", header=False, index=False)
+
+
+def write_argweaver(recomb_map, out, chrom=None):
+    """
+    ArgWeaver (arg-sample --recombmap) map: chrom, start, end, per-bp rate.
+
+    One interval per pair of map positions, the first extended back to 0;
+    chrom (default: the map's) must match the REGION of the .sites file.
+    """
+    starts = recomb_map.position[:-1].copy()
+    starts[0] = 0
+    rates = recomb_map.rate[:-1] * 1e-8
+    with open(out, "w") as f:
+        f.writelines(
+            f"{chrom or recomb_map.chrom}\t{start}\t{end}\t{rate:.6g}\n"
+            for start, end, rate in zip(starts.tolist(), recomb_map.position[1:].tolist(), rates.tolist())
+        )
+
+
+def to_ratemap(recomb_map, sequence_length=None):
+    """
+    msprime RateMap (per-bp rates), identical to
+    msprime.RateMap.read_hapmap(map_file, position_col=1, rate_col=2).
+    """
+    import msprime
+
+    position, rate = recomb_map.position, recomb_map.rate
+    if rate[-1] != 0:
+        raise ValueError("The last entry in the 'rate' column must be zero")
+    genetic = np.insert(np.cumsum(rate[:-1] * np.diff(position / 1e6)), 0, 0) / 100
+    physical = position
+    start, end = physical[0], physical[-1]
+    if start > 0:
+        physical = np.insert(physical, 0, 0)
+        genetic = np.insert(genetic, 0, 0)
+    if sequence_length is not None:
+        if sequence_length < end:
+            raise ValueError(
+                f"The sequence_length cannot be less than the last physical position ({end})"
+            )
+        if sequence_length > end:
+            physical = np.append(physical, sequence_length)
+            genetic = np.append(genetic, genetic[-1])
+    rates = np.diff(genetic) / np.diff(physical)
+    if start != 0:
+        rates[0] = np.nan
+    if end != physical[-1]:
+        rates[-1] = np.nan
+    return msprime.RateMap(position=physical, rate=rates)
+
+
+def load_ratemap(map_file, cache_dir=None, sequence_length=None):
+    """msprime RateMap for a HapMap file, via the parsed-map cache."""
+    return to_ratemap(load_recomb_map(map_file, cache_dir), sequence_length)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert a HapMap recombination map into a tool's map format, via a parsed-map cache."
+    )
+    parser.add_argument("map_file", help="HapMap-style recombination map")
+    parser.add_argument("--format", choices=FORMATS, required=True,
+                        help="relate, threads, argneedle (PLINK .map for --haps), argweaver, "
+                             "or cache (only fill the cache)")
+    parser.add_argument("-o", "--output", default=None, help="Output path (not used with --format cache)")
+    parser.add_argument("--haps", default=None, help="Relate/SHAPEIT .haps whose SNPs the argneedle map covers")
+    parser.add_argument("--chrom", default=None,
+                        help="Contig written to the argweaver map (default: the map's own)")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Directory for parsed maps shared across runs (default: no cache)")
+    parser.add_argument("--pos", type=int, default=1, help="Column number for position, 0-indexed (default: 1)")
+    parser.add_argument("--rate", type=int, default=2,
+                        help="Column number for recombination rate, 0-indexed (default: 2)")
+    parser.add_argument("--map", type=int, default=3,
+                        help="Column number for genetic map distance, 0-indexed (default: 3)")
+    args = parser.parse_args()
+
+    if args.format != "cache" and not args.output:
+        parser.error(f"--output is required for --format {args.format}")
+    if args.format == "argneedle" and not args.haps:
+        parser.error("--haps is required for --format argneedle")
+    if args.format == "cache" and not args.cache_dir:
+        parser.error("--cache-dir is required for --format cache")
+
+    recomb_map = load_recomb_map(args.map_file, args.cache_dir, args.pos, args.rate, args.map)
+    if args.format == "relate":
+        write_relate(recomb_map, args.output)
+    elif args.format == "threads":
+        write_threads(recomb_map, args.output)
+    elif args.format == "argneedle":
+        write_plink_map(recomb_map, args.haps, args.output)
+    elif args.format == "argweaver":
+        write_argweaver(recomb_map, args.output, args.chrom)
+    print(f"{args.map_file}: {len(recomb_map.position)} positions"
+          + (f" -> {args.output}" if args.format != "cache" else ""))
+
+
+if __name__ == "__main__":
+    main()
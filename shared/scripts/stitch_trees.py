@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Stitch per-window tree sequences into one tree sequence.
+
+Each window's tree sequence is (optionally) shifted into chromosome
+coordinates, trimmed to its core interval and appended to the result. Sample
+nodes are shared: the i-th sample of every window is mapped onto the i-th
+sample of the first window, so sample IDs, individuals and populations come
+from the first window. All other nodes, edges, sites and mutations are
+copied per window. Nodes left without edges or mutations by the trimming are
+removed at the end.
+"""
+
+import argparse
+import numpy as np
+import tskit
+
+
+def shifted_tables(ts, offset, sequence_length):
+    """Tables of ts with all coordinates moved right by offset, on a sequence of sequence_length."""
+    tables = ts.dump_tables()
+    if offset + ts.sequence_length > sequence_length:
+        raise ValueError(
+            f"Window of length {ts.sequence_length} at offset {offset} exceeds "
+            f"the stitched sequence length {sequence_length}"
+        )
+    tables.sequence_length = sequence_length
+    if offset:
+        tables.edges.left = tables.edges.left + offset
+        tables.edges.right = tables.edges.right + offset
+        tables.sites.position = tables.sites.position + offset
+    return tables
+
+
+def append_window(tables, window, samples):
+    """Append a trimmed window's tables to tables, mapping its samples onto samples."""
+    window_samples = np.flatnonzero(window.nodes.flags & tskit.NODE_IS_SAMPLE)
+    if len(window_samples) != len(samples):
+        raise ValueError(
+            f"Windows disagree on the number of samples ({len(window_samples)} vs {len(samples)})"
+        )
+    if window.populations.num_rows > tables.populations.num_rows:
+        raise ValueError("A window references populations missing from the first window")
+
+    is_new = np.ones(window.nodes.num_rows, dtype=bool)
+    is_new[window_samples] = False
+    node_map = np.empty(window.nodes.num_rows, dtype=np.int32)
+    node_map[window_samples] = samples
+    node_map[is_new] = tables.nodes.num_rows + np.arange(np.sum(is_new), dtype=np.int32)
+
+    nodes = window.nodes.copy()
+    nodes.keep_rows(is_new)
+    tables.nodes.append_columns(
+        flags=nodes.flags,
+        time=nodes.time,
+        population=nodes.population,
+        individual=np.full(nodes.num_rows, tskit.NULL, dtype=np.int32),
+        metadata=nodes.metadata,
+        metadata_offset=nodes.metadata_offset,
+    )
+    tables.edges.append_columns(
+        left=window.edges.left,
+        right=window.edges.right,
+        parent=node_map[window.edges.parent],
+        child=node_map[window.edges.child],
+        metadata=window.edges.metadata,
+        metadata_offset=window.edges.metadata_offset,
+    )
+
+    site_offset = tables.sites.num_rows
+    mutation_offset = tables.mutations.num_rows
+    tables.sites.append_columns(
+        position=window.sites.position,
+        ancestral_state=window.sites.ancestral_state,
+        ancestral_state_offset=window.sites.ancestral_state_offset,
+        metadata=window.sites.metadata,
+        metadata_offset=window.sites.metadata_offset,
+    )
+    parent = window.mutations.parent
+    tables.mutations.append_columns(
+        site=window.mutations.site + site_offset,
+        node=node_map[window.mutations.node],
+        time=window.mutations.time,
+        derived_state=window.mutations.derived_state,
+        derived_state_offset=window.mutations.derived_state_offset,
+        parent=np.where(parent == tskit.NULL, tskit.NULL, parent + mutation_offset).astype(np.int32),
+        metadata=window.mutations.metadata,
+        metadata_offset=window.mutations.metadata_offset,
+    )
+
+
+def stitch_tree_sequences(tree_sequences, cores, offsets=None, sequence_length=None):
+    """
+    Stitch tree_sequences, keeping each on its (start, end) core of cores.
+
+    offsets shift each window into chromosome coordinates (for tools such as
+    Singer that write window-relative positions; default 0). The result has
+    sequence_length (default: the largest shifted window end).
+    """
+    if len(tree_sequences) != len(cores):
+        raise ValueError("Need one core interval per tree sequence")
+    offsets = [0] * len(tree_sequences) if offsets is None else offsets
+    if sequence_length is None:
+        sequence_length = max(offset + ts.sequence_length for ts, offset in zip(tree_sequences, offsets))
+    order = np.argsort([core[0] for core in cores])
+    if any(cores[i][1] > cores[j][0] for i, j in zip(order[:-1], order[1:])):
+        raise ValueError("Core intervals overlap")
+
+    tables = samples = None
+    for i in order:
+        window = shifted_tables(tree_sequences[i], offsets[i], sequence_length)
+        window.keep_intervals([cores[i]], simplify=False)
+        if tables is None:
+            tables = window
+            samples = np.flatnonzero(tables.nodes.flags & tskit.NODE_IS_SAMPLE).astype(np.int32)
+        else:
+            append_window(tables, window, samples)
+
+    tables.sort()
+    # Drop nodes orphaned by the trimming without otherwise changing the topology
+    tables.simplify(
+        samples,
+        keep_unary=True,
+        keep_input_roots=True,
+        filter_sites=False,
+        filter_populations=False,
+        filter_individuals=False,
+    )
+    tables.build_index()
+    tables.compute_mutation_parents()
+    return tables.tree_sequence()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Trim overlapping per-window tree sequences to their cores and concatenate them."
+    )
+    parser.add_argument("--trees", nargs="+", required=True, help="Per-window .trees files")
+    parser.add_argument(
+        "--cores", nargs="+", type=float, required=True,
+        help="Core start and end of each window, in the same order as --trees (start1 end1 start2 end2 ...)"
+    )
+    parser.add_argument(
+        "--offsets", nargs="+", type=float, default=None,
+        help="Shift applied to each window's coordinates (default: 0, i.e. already in chromosome coordinates)"
+    )
+    parser.add_argument("--sequence-length", type=float, default=None,
+                        help="Sequence length of the stitched result (default: largest window end)")
+    parser.add_argument("--out", required=True, help="Output .trees path")
+    args = parser.parse_args()
+
+    if len(args.cores) != 2 * len(args.trees):
+        parser.error("--cores needs a start and an end for every --trees file")
+    if args.offsets is not None and len(args.offsets) != len(args.trees):
+        parser.error("--offsets needs one value per --trees file")
+
+    cores = list(zip(args.cores[::2], args.cores[1::2]))
+    tree_sequences = [tskit.load(path) for path in args.trees]
+    stitched = stitch_tree_sequences(tree_sequences, cores, args.offsets, args.sequence_length)
+    stitched.dump(args.out)
+    print(f"Stitched {len(tree_sequences)} windows into {stitched.num_trees} trees, "
+          f"{stitched.num_sites} sites: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Deduplicated archive of a region's MCMC tree sequence samples.
+
+Relate branch resampling and Singer write one .trees file per retained
+iteration, and consecutive samples share most of their tables. An archive
+stores a series of samples in one file:
+
+- every table column of every sample (from TableCollection.asdict) is a
+  content-addressed block, so a column identical across samples (node flags,
+  sites, populations, Relate's fixed topology, ...) is stored once while
+  columns that change, such as node and mutation times, are stored per sample;
+- edges are stored once as a union table of distinct (left, right, parent,
+  child) rows, and each sample keeps only an index into it (itself a
+  deduplicated block), so topology shared between Singer samples costs 4
+  bytes per edge instead of 24;
+- blocks are zlib-compressed when that saves space and otherwise stored raw
+  and 64-byte aligned.
+
+The reader memory-maps the file and decodes only the blocks of the sample
+asked for, so any sample is available as a tskit.TreeSequence without
+unpacking the series.
+
+Layout: MAGIC, blocks, JSON header, header offset (uint64), MAGIC.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import zlib
+
+import numpy as np
+import tskit
+
+MAGIC = b"TSARCHV1"
+ALIGN = 64
+
+# Blocks smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 4096
+# Compressed blocks are kept only if they are at most this fraction of the raw size
+MAX_COMPRESS_RATIO = 0.9
+
+EDGE_ROW = np.dtype([("left", "<f8"), ("right", "<f8"), ("parent", "<i4"), ("child", "<i4")])
+EDGE_KEY = np.dtype((np.void, EDGE_ROW.itemsize))
+
+
+def edge_rows(edges):
+    """Packed (left, right, parent, child) rows of an edge table, and their byte keys."""
+    rows = np.empty(edges.num_rows, dtype=EDGE_ROW)
+    for name in EDGE_ROW.names:
+        rows[name] = getattr(edges, name)
+    return rows, rows.view(EDGE_KEY)
+
+
+class ArchiveWriter:
+    """
+    Write tree sequences into an archive, one add() per sample.
+
+    The file is written to a temporary path and moved into place by close()
+    (or on leaving a with block without an error).
+    """
+
+    def __init__(self, path, compress_level=6):
+        self.path = path
+        self.compress_level = compress_level
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(MAGIC)
+        self._blocks = []
+        self._digests = {}
+        self._samples = []
+        # Distinct edge rows in first-seen order, plus their keys sorted for lookups
+        self._edges = []
+        self._num_edges = 0
+        self._sorted_keys = np.empty(0, dtype=EDGE_KEY)
+        self._sorted_ids = np.empty(0, dtype=np.int64)
+
+    def _block(self, array):
+        """Id of the block holding array, writing it if its content is new."""
+        array = np.ascontiguousarray(array)
+        data = array.tobytes()
+        digest = hashlib.sha1(f"{array.dtype.str}:{array.shape}:".encode() + data).hexdigest()
+        if digest in self._digests:
+            return self._digests[digest]
+
+        codec = "raw"
+        if self.compress_level and len(data) >= MIN_COMPRESS_BYTES:
+            compressed = zlib.compress(data, self.compress_level)
+            if len(compressed) <= MAX_COMPRESS_RATIO * len(data):
+                codec, data = "zlib", compressed
+        offset = self._file.tell()
+        padding = -offset % ALIGN
+        self._file.write(b"\0" * padding)
+        self._file.write(data)
+        self._blocks.append({
+            "offset": offset + padding,
+            "nbytes": len(data),
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "codec": codec,
+        })
+        self._digests[digest] = len(self._blocks) - 1
+        return len(self._blocks) - 1
+
+    def _edge_index(self, edges):
+        """Index of every edge of the table into the union edge table, adding new rows."""
+        rows, keys = edge_rows(edges)
+        pos = np.searchsorted(self._sorted_keys, keys)
+        found = pos < len(self._sorted_keys)
+        found[found] = self._sorted_keys[pos[found]] == keys[found]
+        index = np.empty(len(keys), dtype=np.int64)
+        index[found] = self._sorted_ids[pos[found]]
+
+        new_keys, first, inverse = np.unique(keys[~found], return_index=True, return_inverse=True)
+        new_ids = self._num_edges + np.arange(len(new_keys))
+        index[~found] = new_ids[inverse.ravel()]
+        self._edges.append(rows[~found][first])
+        self._num_edges += len(new_keys)
+        at = np.searchsorted(self._sorted_keys, new_keys)
+        self._sorted_keys = np.insert(self._sorted_keys, at, new_keys)
+        self._sorted_ids = np.insert(self._sorted_ids, at, new_ids)
+        return index.astype(np.int32 if self._num_edges < 2**31 else np.int64)
+
+    def add(self, ts, label=None):
+        """Append tree sequence ts as the next sample."""
+        tables = ts.dump_tables() if isinstance(ts, tskit.TreeSequence) else ts
+        blocks, values = {}, {}
+
+        def collect(prefix, d):
+            for key, value in d.items():
+                name = f"{prefix}{key}"
+                if name in ("indexes", "edges/left", "edges/right", "edges/parent", "edges/child"):
+                    continue
+                if isinstance(value, dict):
+                    collect(f"{name}/", value)
+                elif isinstance(value, np.ndarray):
+                    blocks[name] = self._block(value)
+                elif isinstance(value, bytes):
+                    blocks[name] = self._block(np.frombuffer(value, dtype=np.uint8))
+                    values[name] = "bytes"
+                else:
+                    values[name] = value
+
+        collect("", tables.asdict())
+        blocks["edges/index"] = self._block(self._edge_index(tables.edges))
+        label = str(len(self._samples)) if label is None else str(label)
+        self._samples.append({"label": label, "blocks": blocks, "values": values})
+
+    def close(self):
+        if self._file.closed:
+            return
+        edges = np.concatenate(self._edges) if self._edges else np.empty(0, dtype=EDGE_ROW)
+        union = {name: self._block(edges[name]) for name in EDGE_ROW.names}
+        header = json.dumps({
+            "version": 1,
+            "edges": union,
+            "blocks": self._blocks,
+            "samples": self._samples,
+        }).encode()
+        offset = self._file.tell()
+        self._file.write(header)
+        self._file.write(np.uint64(offset).tobytes())
+        self._file.write(MAGIC)
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class TreesArchive:
+    """
+    Random access to the samples of an archive.
+
+    archive[i] (or archive[label]) is the i-th sample as a tskit.TreeSequence;
+    only the blocks that sample uses are read from the memory-mapped file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        tail = self._data[-len(MAGIC) - 8:]
+        if bytes(self._data[:len(MAGIC)]) != MAGIC or bytes(tail[8:]) != MAGIC:
+            raise ValueError(f"{path} is not a tree sequence archive")
+        offset = int(tail[:8].view(np.uint64)[0])
+        header = json.loads(bytes(self._data[offset:len(self._data) - len(MAGIC) - 8]))
+        self._blocks = header["blocks"]
+        self._samples = header["samples"]
+        self._edges = header["edges"]
+        self.labels = [sample["label"] for sample in self._samples]
+
+    def __len__(self):
+        return len(self._samples)
+
+    def _array(self, block_id):
+        block = self._blocks[block_id]
+        data = self._data[block["offset"]:block["offset"] + block["nbytes"]]
+        if block["codec"] == "zlib":
+            data = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+        return data.view(np.dtype(block["dtype"])).reshape(block["shape"])
+
+    def _position(self, key):
+        if isinstance(key, str):
+            return self.labels.index(key)
+        index = range(len(self))[key]
+        return index
+
+    def tables(self, key):
+        """TableCollection of a sample, by position or label."""
+        sample = self._samples[self._position(key)]
+        d = {}
+
+        def put(name, value):
+            *path, leaf = name.split("/")
+            target = d
+            for part in path:
+                target = target.setdefault(part, {})
+            target[leaf] = value
+
+        for name, value in sample["values"].items():
+            if value != "bytes":
+                put(name, tuple(value) if name == "encoding_version" else value)
+        for name, block_id in sample["blocks"].items():
+            if name == "edges/index":
+                index = self._array(block_id)
+                for column, union_id in self._edges.items():
+                    put(f"edges/{column}", self._array(union_id)[index])
+            elif sample["values"].get(name) == "bytes":
+                put(name, self._array(block_id).tobytes())
+            else:
+                put(name, self._array(block_id))
+        tables = tskit.TableCollection.fromdict(d)
+        tables.build_index()
+        return tables
+
+    def __getitem__(self, key):
+        return self.tables(key).tree_sequence()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+def write_archive(paths, out, labels=None, compress_level=6):
+    """Archive the .trees files in paths (in order), labelled by labels or their file names."""
+    if labels is not None and len(labels) != len(paths):
+        raise ValueError("Need one label per tree sequence")
+    with ArchiveWriter(out, compress_level) as writer:
+        for i, path in enumerate(paths):
+            label = labels[i] if labels is not None else os.path.basename(path).removesuffix(".trees")
+            writer.add(tskit.load(path), label)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Store a series of tree sequence samples in one deduplicated archive, and read them back."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    write = commands.add_parser("write", help="Archive .trees files, in the order given")
+    write.add_argument("trees", nargs="+", help=".trees files of the samples")
+    write.add_argument("-o", "--out", required=True, help="Output archive")
+    write.add_argument("--labels", nargs="+", default=None,
+                       help="Sample labels (default: file names without .trees)")
+    write.add_argument("--compress-level", type=int, default=6,
+                       help="zlib level for compressible blocks, 0 to store all raw (default: 6)")
+    write.add_argument("--remove", action="store_true", help="Delete the .trees files once archived")
+
+    extract = commands.add_parser("extract", help="Write one sample of an archive as a .trees file")
+    extract.add_argument("archive", help="Archive file")
+    extract.add_argument("sample", help="Sample label or position (negative counts from the end)")
+    extract.add_argument("-o", "--out", required=True, help="Output .trees path")
+
+    listing = commands.add_parser("list", help="Print the samples of an archive")
+    listing.add_argument("archive", help="Archive file")
+    args = parser.parse_args()
+
+    if args.command == "write":
+        write_archive(args.trees, args.out, args.labels, args.compress_level)
+        raw = sum(os.path.getsize(path) for path in args.trees)
+        print(f"Archived {len(args.trees)} samples ({raw} bytes) into {args.out} "
+              f"({os.path.getsize(args.out)} bytes)")
+        if args.remove:
+            for path in args.trees:
+                os.remove(path)
+    elif args.command == "extract":
+        archive = TreesArchive(args.archive)
+        key = args.sample if args.sample in archive.labels else int(args.sample)
+        archive[key].dump(args.out)
+    else:
+        archive = TreesArchive(args.archive)
+        for i, label in enumerate(archive.labels):
+            print(i, label, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Convert Singer MCMC samples to tskit while Singer is still sampling.
+
+Singer writes each sample i as {prefix}_{recombs,muts,nodes,branches}_{i}.txt.
+A sample is complete once any file of sample i + 1 exists (Singer has moved
+on) or Singer has exited. Each complete sample in range(start, end, step) is
+converted with `convert_to_tskit` in a pool of workers, into
+{prefix}.tskit_{i}.trees (the same files a single batch conversion writes).
+Conversions write under a temporary prefix and are renamed when done, so a
+.trees file is never partial and existing ones are skipped on reruns.
+
+With --cleanup, the text files of converted and non-retained samples are
+deleted once they are complete. The last sample's text files are always
+kept: they are the workflow's Singer outputs and what -resume restarts from.
+
+With --stats, every sample (retained or not) is converted and folded into
+running posterior summaries (shared/scripts/posterior_stats.py); the .trees
+of non-retained samples are deleted again once folded in.
+
+Usage:
+    stream_convert.py --prefix P --end N --step S [--workers W] [--cleanup] -- singer_master ...
+Without a command after --, the existing samples of a finished run are converted.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../shared/scripts"))
+from posterior_stats import update_file
+
+KINDS = ["recombs", "muts", "nodes", "branches"]
+
+# Seconds between checks for newly written samples
+POLL_SECONDS = 5
+
+
+def sample_files(prefix, i):
+    """Singer's text files for sample i."""
+    return [f"{prefix}_{kind}_{i}.txt" for kind in KINDS]
+
+
+def trees_file(prefix, i):
+    return f"{prefix}.tskit_{i}.trees"
+
+
+def remove_sample(prefix, i):
+    for path in sample_files(prefix, i):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def first_sample(prefix, end):
+    """Lowest sample with text files on disk (earlier ones were cleaned up by a previous run), else 0."""
+    for i in range(end):
+        if any(map(os.path.exists, sample_files(prefix, i))):
+            return i
+    return 0
+
+
+def convert_sample(prefix, i, cleanup=False, retained=True, stats=None, stats_options=None):
+    """
+    Convert sample i to {prefix}.tskit_{i}.trees (unless already done), fold it
+    into the stats file if any, then optionally drop its text files. Non-retained
+    samples are only converted for the stats, and their .trees removed after.
+    """
+    if not os.path.exists(trees_file(prefix, i)):
+        partial = f"{prefix}.tskit.partial"
+        subprocess.run(
+            ["convert_to_tskit", "-input", prefix, "-output", partial,
+             "-start", str(i), "-end", str(i + 1), "-step", "1"],
+            check=True,
+        )
+        os.replace(f"{partial}_{i}.trees", trees_file(prefix, i))
+    if stats:
+        update_file(stats, trees_file(prefix, i), i, remove=not retained, **(stats_options or {}))
+    if cleanup:
+        remove_sample(prefix, i)
+    return i
+
+
+def stream_convert(prefix, end, step, start=0, workers=1, command=None, cleanup=False,
+                   poll=POLL_SECONDS, stats=None, stats_options=None):
+    """
+    Run command (if any) and convert samples range(start, end, step) as they complete.
+    With stats, every sample is converted and folded into that posterior_stats file.
+
+    Returns the command's exit code (0 without a command).
+    """
+    retained = set(range(start, end, step))
+    keep = end - 1
+    proc = subprocess.Popen(command) if command else None
+    futures = []
+    next_sample = first_sample(prefix, end)  # lowest sample not yet known to be complete
+    try:
+        with ThreadPoolExecutor(workers) as pool:
+            while True:
+                finished = proc is None or proc.poll() is not None
+                while next_sample < end and all(map(os.path.exists, sample_files(prefix, next_sample))) and (
+                    finished or any(map(os.path.exists, sample_files(prefix, next_sample + 1)))
+                ):
+                    i = next_sample
+                    next_sample += 1
+                    drop = cleanup and i != keep
+                    if stats or (i in retained and not os.path.exists(trees_file(prefix, i))):
+                        futures.append(pool.submit(convert_sample, prefix, i, drop, i in retained,
+                                                   stats, stats_options))
+                    elif drop:
+                        remove_sample(prefix, i)
+                # Fail early rather than after Singer finishes
+                for future in futures:
+                    if future.done():
+                        future.result()
+                if finished:
+                    break
+                time.sleep(poll)
+            for future in futures:
+                future.result()
+    finally:
+        if proc is not None and proc.poll() is None:
+            proc.terminate()
+            proc.wait()
+
+    returncode = 0 if proc is None else proc.returncode
+    if returncode == 0 and next_sample < end:
+        raise RuntimeError(f"Singer samples {next_sample}..{end - 1} of {prefix} are missing")
+    print(f"Converted {len(futures)} samples of {prefix} to tskit" + (f", statistics in {stats}" if stats else ""))
+    return returncode
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert Singer samples to tskit as they are written, optionally while running Singer.",
+        usage="%(prog)s --prefix PREFIX --end N [options] [-- singer_master ...]",
+    )
+    parser.add_argument("--prefix", required=True, help="Singer output prefix (as passed to -output)")
+    parser.add_argument("--start", type=int, default=0, help="First sample to convert (default: 0)")
+    parser.add_argument("--end", type=int, required=True, help="Number of Singer samples (-n)")
+    parser.add_argument("--step", type=int, default=1, help="Convert every step-th sample (default: 1)")
+    parser.add_argument("--workers", type=int, default=1, help="Parallel conversions (default: 1)")
+    parser.add_argument("--cleanup", action="store_true",
+                        help="Delete text files of converted and non-retained samples (the last sample is kept)")
+    parser.add_argument("--stats", default=None,
+                        help="Fold every sample into this posterior_stats state (.npz); see posterior_stats.py")
+    parser.add_argument("--stats-window-size", type=float, default=1e6,
+                        help="Genomic window size of a new stats state (default: 1e6)")
+    parser.add_argument("--poll", type=float, default=POLL_SECONDS,
+                        help=f"Seconds between checks for new samples (default: {POLL_SECONDS})")
+    argv = sys.argv[1:]
+    command = None
+    if "--" in argv:
+        split = argv.index("--")
+        argv, command = argv[:split], argv[split + 1:] or None
+    args = parser.parse_args(argv)
+
+    sys.exit(stream_convert(args.prefix, args.end, args.step, args.start, args.workers,
+                            command, args.cleanup, args.poll, args.stats,
+                            {"window_size": args.stats_window_size}))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
 #!/bin/bash
-# Usage: ./run_vcf2zarr.sh input.vcf.gz /path/to/output_dir
+# Usage: ./run_vcf2zarr.sh input.vcf.gz /path/to/output_dir [workers] [variants_chunk_size] [samples_chunk_size]
+# explode/encode are split into genomic-region partitions across `workers` processes
+# (default: all cores; explode needs a .tbi/.csi index). The intermediate .icf is
+# removed once the .vcz passes `vcf2zarr inspect`.
 
 
 #zarr version should < 3
@@ -7,6 +10,9 @@ set -euo pipefail
 
 vcf_file="$1"
 out_path="$2"
+workers="${3:-$(nproc)}"
+variants_chunk_size="${4:-}"
+samples_chunk_size="${5:-}"
 
 # ensure output directory exists
 mkdir -p "$out_path"
@@ -15,10 +21,20 @@ mkdir -p "$out_path"
 filename=$(basename "$vcf_file")
 base=${filename%%.vcf*}
 
+encode_flags=()
+if [ -n "$variants_chunk_size" ]; then
+    encode_flags+=(--variants-chunk-size "$variants_chunk_size")
+fi
+if [ -n "$samples_chunk_size" ]; then
+    encode_flags+=(--samples-chunk-size "$samples_chunk_size")
+fi
+
 echo "Processing $vcf_file"
 echo "Base name: $base"
 
-vcf2zarr explode "$vcf_file" "${out_path}/${base}.icf"
-vcf2zarr encode "${out_path}/${base}.icf" "${out_path}/${base}.vcz"
+vcf2zarr explode --force --worker-processes "$workers" "$vcf_file" "${out_path}/${base}.icf"
+vcf2zarr encode --force --worker-processes "$workers" "${encode_flags[@]}" "${out_path}/${base}.icf" "${out_path}/${base}.vcz"
+vcf2zarr inspect "${out_path}/${base}.vcz" > /dev/null
+rm -rf "${out_path}/${base}.icf"
 
 echo "Finished: ${out_path}/${base}.vcz"
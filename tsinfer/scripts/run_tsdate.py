@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import argparse
+import tskit
+import tsdate
+
+
+def date_tree_sequence(ts, mutation_rate, method=None):
+    """Date an (undated, simplified) tree sequence with tsdate."""
+    kwargs = {"method": method} if method else {}
+    return tsdate.date(ts, mutation_rate=mutation_rate, progress=True, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Date an inferred tree sequence with tsdate."
+    )
+    parser.add_argument(
+        "--trees", required=True,
+        help="Undated tree sequence (e.g. {uid}.tsinfer.undated.trees)"
+    )
+    parser.add_argument(
+        "--out", required=True,
+        help="Output path for the dated tree sequence"
+    )
+    parser.add_argument(
+        "--mut-rate", type=float, default=2.35e-8,
+        help="Per-site mutation rate (default: 2.35e-8)"
+    )
+    parser.add_argument(
+        "--method", default=None,
+        help="tsdate method, e.g. variational_gamma, inside_outside, maximization "
+             "(default: tsdate's default)"
+    )
+    args = parser.parse_args()
+
+    print(f"Dating {args.trees} with mu={args.mut_rate}, method={args.method or 'default'}")
+    dated_ts = date_tree_sequence(tskit.load(args.trees), args.mut_rate, method=args.method)
+    dated_ts.dump(args.out)
+    print(f"Dated tree sequence written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
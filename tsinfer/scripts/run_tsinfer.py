@@ -1,11 +1,176 @@
 #!/usr/bin/env python3
 import argparse
+import sys
 import tsinfer
-import msprime
 import zarr
 import pyfaidx
-import tsdate
+import tskit
+import numpy as np
+import hashlib
 import os
+from run_tsdate import date_tree_sequence
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../shared/scripts"))
+from recomb_map import load_ratemap
+
+STAGES = ["generate_ancestors", "match_ancestors", "match_samples", "date"]
+
+# Bases are copied from the FASTA into the ancestral cache in chunks of this size.
+FASTA_CHUNK = 1 << 24
+
+
+def ancestral_cache_path(fasta, chrom, cache_dir):
+    """Cache file for one contig of one FASTA, keyed on the FASTA's path, size and mtime."""
+    stat = os.stat(fasta)
+    key = hashlib.sha1(f"{os.path.abspath(fasta)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()[:12]
+    return os.path.join(cache_dir, f"{os.path.basename(fasta)}.{chrom}.{key}.npy")
+
+
+def build_ancestral_cache(reader, chrom, path):
+    """Write a contig as an upper-cased uint8 .npy, streaming the FASTA in chunks."""
+    record = reader[chrom]
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    bases = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(len(record),))
+    for start in range(0, len(record), FASTA_CHUNK):
+        chunk = np.frombuffer(record[start:start + FASTA_CHUNK].seq.encode(), dtype=np.uint8)
+        bases[start:start + len(chunk)] = chunk
+    bases[(bases >= ord("a")) & (bases <= ord("z"))] -= ord("a") - ord("A")
+    bases.flush()
+    del bases
+    # Concurrent jobs on the same contig each write their own temp file; the rename is atomic.
+    os.replace(tmp_path, path)
+
+
+def load_ancestral_states(fasta, chrom, positions, cache_dir=None):
+    """
+    Look up the ancestral base for each entry of positions.
+
+    Positions index the contig sequence directly (as in
+    tsinfer.add_ancestral_state_array) and the last position is set to "N".
+    With cache_dir, the contig is read from a memory-mapped .npy shared by all
+    regions on that contig (built on first use); otherwise only the span
+    covered by positions is read from the FASTA.
+    """
+    lo, hi = int(positions.min()), int(positions.max()) + 1
+    reader = pyfaidx.Fasta(fasta)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        path = ancestral_cache_path(fasta, chrom, cache_dir)
+        if not os.path.exists(path):
+            print(f"Building ancestral state cache: {path}")
+            build_ancestral_cache(reader, chrom, path)
+        window = np.load(path, mmap_mode="r")[lo:hi]
+    else:
+        window = np.frombuffer(reader[chrom][lo:hi].seq.upper().encode(), dtype=np.uint8)
+
+    # Pad so the last position may sit one past the end of the contig, as before.
+    last_pos = positions[-1]
+    padded = np.full(hi - lo, ord("N"), dtype=np.uint8)
+    padded[:len(window)] = window
+    if np.any((positions - lo >= len(window)) & (positions != last_pos)):
+        raise ValueError(
+            f"Contig {chrom} in {fasta} is shorter than the maximum variant position"
+        )
+    states = padded[positions - lo]
+    states[positions == last_pos] = ord("N")
+    return states.view("S1").astype("U1")
+
+
+def add_ancestral_states(vcf_zarr, states, array_name="ancestral_state"):
+    """Store per-site ancestral states in the same layout as tsinfer.add_ancestral_state_array."""
+    ancestral_array = vcf_zarr.create_dataset(
+        array_name,
+        data=states,
+        shape=states.shape,
+        chunks=vcf_zarr["variant_position"].chunks,
+        dtype="U1",
+    )
+    ancestral_array.attrs["_ARRAY_DIMENSIONS"] = ["variants"]
+    return ancestral_array
+
+
+def open_variant_data(args, vdata_path):
+    """
+    Open the Zarr for inference, restricted to sites in --region if given.
+
+    Windows share one .vcz, so a regional run reads its ancestral states from
+    the FASTA (or the ancestral cache) at every stage instead of writing them
+    into the Zarr, and masks the sites outside the window.
+    """
+    if args.region is None:
+        return tsinfer.VariantData(vdata_path, ancestral_state="ancestral_state")
+    start, end = args.region
+    positions = zarr.open(vdata_path, mode="r")["variant_position"][:]
+    # States are looked up over all sites so the window matches a whole-region run
+    ancestral_states = load_ancestral_states(
+        args.fasta, args.chrom, positions, cache_dir=args.ancestral_cache
+    )
+    site_mask = (positions < start) | (positions >= end)
+    return tsinfer.VariantData(
+        vdata_path, ancestral_state=ancestral_states[~site_mask], site_mask=site_mask
+    )
+
+
+def generate_ancestors_stage(args, vdata_path, ancestors_path):
+    """Annotate the Zarr with ancestral states and write the .ancestors checkpoint."""
+    # Regional runs share the Zarr and keep their ancestral states in memory
+    if args.region is None:
+        # Open zarr file
+        vcf_zarr = zarr.open(vdata_path)
+
+        # Read ancestral states for the variant positions only
+        positions = vcf_zarr["variant_position"][:]
+        ancestral_states = load_ancestral_states(
+            args.fasta, args.chrom, positions, cache_dir=args.ancestral_cache
+        )
+
+        # Remove old dataset if present
+        if "ancestral_state" in vcf_zarr:
+            del vcf_zarr["ancestral_state"]
+
+        # Add ancestral states
+        add_ancestral_states(vcf_zarr, ancestral_states)
+
+    vdata = open_variant_data(args, vdata_path)
+    ancestors = tsinfer.generate_ancestors(vdata, path=ancestors_path, num_threads=args.threads)
+    print(f"Generated {ancestors.num_ancestors} ancestors: {ancestors_path}")
+
+
+def match_ancestors_stage(args, vdata_path, ancestors_path, ancestors_ts_path):
+    """Match ancestors against each other and write the .ancestors.trees checkpoint."""
+    vdata = open_variant_data(args, vdata_path)
+    ancestors = tsinfer.load(ancestors_path)
+    # As in tsinfer.infer, no recombination rate is used when matching ancestors
+    ancestors_ts = tsinfer.match_ancestors(vdata, ancestors, num_threads=args.threads)
+    ancestors_ts.dump(ancestors_ts_path)
+    print(f"Ancestors tree sequence written to {ancestors_ts_path}")
+
+
+def match_samples_stage(args, vdata_path, ancestors_ts_path, undated_path):
+    """Match samples against the ancestors tree sequence and write the simplified, undated result."""
+    #read in RateMap (parsed once per map when a cache directory is given)
+    recombination_map = load_ratemap(args.recomb_map, cache_dir=args.recomb_map_cache)
+    vdata = open_variant_data(args, vdata_path)
+    ancestors_ts = tskit.load(ancestors_ts_path)
+    inferred_ts = tsinfer.match_samples(
+        vdata,
+        ancestors_ts,
+        recombination_rate=recombination_map,
+        num_threads=args.threads
+    )
+    print(f"Inferred a genetic genealogy for {inferred_ts.num_samples} (haploid) genomes")
+    inferred_ts.simplify().dump(undated_path)
+    print(f"Undated tree sequence written to {undated_path}")
+
+
+def date_stage(args, undated_path, output_path):
+    """Date the undated tree sequence with tsdate."""
+    inferred_ts_w_dates = date_tree_sequence(
+        tskit.load(undated_path), args.mut_rate, method=args.tsdate_method
+    )
+    inferred_ts_w_dates.dump(output_path)
+    print(f"Dated tree sequence written to {output_path}")
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -16,21 +181,29 @@ def main():
         help="Path to input VCF zarr file (.vcz)"
     )
     parser.add_argument(
-        "--fasta", required=True,
-        help="Path to FASTA reference file"
+        "--fasta", default=None,
+        help="Path to FASTA reference file (required for generate_ancestors)"
     )
     parser.add_argument(
         "--outdir", default=None,
         help="Output directory (default: same folder as input .vcz)"
     )
     parser.add_argument(
-        "--recomb-map",required=True,
-        help="Per-site recombination rate (default: 1.36e-8)"
+        "--recomb-map", default=None,
+        help="HapMap-style recombination map (required for match_samples)"
+    )
+    parser.add_argument(
+        "--recomb-map-cache", default=None,
+        help="Directory of parsed recombination maps shared across runs (default: parse the map text)"
     )
     parser.add_argument(
         "--mut-rate", type=float, default=2.35e-8,
         help="Per-site mutation rate (default: 2.35e-8)"
     )
+    parser.add_argument(
+        "--tsdate-method", default=None,
+        help="tsdate method used by the date stage (default: tsdate's default)"
+    )
     parser.add_argument(
         "--threads", type=int, default=4,
         help="Number of threads to use for inference"
@@ -39,8 +212,37 @@ def main():
         "--chrom", default="NC_000014.9",
         help="Chromosome ID in FASTA (default: NC_000014.9)"
     )
+    parser.add_argument(
+        "--ancestral-cache", default=None,
+        help="Directory for memory-mapped per-contig ancestral arrays shared across runs "
+             "(default: read only the variant span from the FASTA)"
+    )
+    parser.add_argument(
+        "--region", nargs=2, type=int, default=None, metavar=("START", "END"),
+        help="Only infer from sites with START <= position < END (one window of a sharded run); "
+             "requires --fasta at every stage"
+    )
+    parser.add_argument(
+        "--name", default=None,
+        help="Basename of the checkpoint and output files (default: derived from the .vcz name)"
+    )
+    parser.add_argument(
+        "--stage", choices=STAGES + ["all"], default="all",
+        help="Inference stage to run; each writes a checkpoint read by the next (default: all)"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="With --stage all, skip stages whose checkpoint already exists"
+    )
 
     args = parser.parse_args()
+    stages = STAGES if args.stage == "all" else [args.stage]
+    if "generate_ancestors" in stages and not args.fasta:
+        parser.error("--fasta is required for generate_ancestors")
+    if "match_samples" in stages and not args.recomb_map:
+        parser.error("--recomb-map is required for match_samples")
+    if args.region is not None and not args.fasta and set(stages) - {"date"}:
+        parser.error("--fasta is required with --region")
 
     # If outdir not given, default to input folder
     input_dir = os.path.dirname(os.path.abspath(args.zarr))
@@ -48,54 +250,38 @@ def main():
     os.makedirs(outdir, exist_ok=True)
 
     # derive output filename (replace .vcz with .trees)
-    base = os.path.splitext(os.path.basename(args.zarr))[0]
+    base = os.path.splitext(os.path.basename(args.zarr.rstrip("/")))[0]
     if base.endswith(".vcf"):  # safeguard if file is like sample.vcf.vcz
         base = os.path.splitext(base)[0]
+    if args.name:
+        base = args.name
     output_path = os.path.join(outdir, base + ".tsinfer.trees")
-
-    # derive output name by stripping ".vcz" (if present)
-    #base = os.path.splitext(args.zarr)[0]
-    #output_path = base + ".tskit.trees"
+    undated_path = os.path.join(outdir, base + ".tsinfer.undated.trees")
+    ancestors_path = os.path.join(outdir, base + ".ancestors")
+    ancestors_ts_path = os.path.join(outdir, base + ".ancestors.trees")
 
     print(f"Input Zarr: {args.zarr}")
     print(f"Output Trees: {output_path}")
 
-    # Open zarr file
-    vcf_zarr = zarr.open(args.zarr)
-
-    # Read reference FASTA for ancestral states
-    reader = pyfaidx.Fasta(args.fasta)
-    ancestral_str = str(reader[args.chrom])
-
-    # Replace last known position with N
-    last_pos = vcf_zarr['variant_position'][-1]
-    ancestral_str = ancestral_str[:last_pos] + "N" + ancestral_str[(last_pos + 1):]
-
-    # Remove old dataset if present
-    if "ancestral_state" in vcf_zarr:
-        del vcf_zarr["ancestral_state"]
-
-    # Add ancestral states
-    tsinfer.add_ancestral_state_array(vcf_zarr, ancestral_str)
-    #read in RateMap
-    recombination_map = msprime.RateMap.read_hapmap(args.recomb_map, position_col = 1, rate_col = 2)
-    # Run tsinfer
-    vdata = tsinfer.VariantData(args.zarr, ancestral_state="ancestral_state")
-    inferred_ts = tsinfer.infer(
-        vdata,
-        recombination_rate=recombination_map,
-        num_threads=args.threads
-    )
-    print(f"Inferred a genetic genealogy for {inferred_ts.num_samples} (haploid) genomes")
-
-    # Date with tsdate
-    inferred_ts_w_dates = tsdate.date(
-        inferred_ts.simplify(),
-        mutation_rate=args.mut_rate,
-        progress=True
-    )
-    inferred_ts_w_dates.dump(output_path)
-    print(f"Dated tree sequence written to {output_path}")
+    checkpoints = {
+        "generate_ancestors": ancestors_path,
+        "match_ancestors": ancestors_ts_path,
+        "match_samples": undated_path,
+        "date": output_path,
+    }
+    for stage in stages:
+        if args.resume and args.stage == "all" and os.path.exists(checkpoints[stage]):
+            print(f"Skipping {stage}: found {checkpoints[stage]}")
+            continue
+        print(f"Running stage: {stage}")
+        if stage == "generate_ancestors":
+            generate_ancestors_stage(args, args.zarr, ancestors_path)
+        elif stage == "match_ancestors":
+            match_ancestors_stage(args, args.zarr, ancestors_path, ancestors_ts_path)
+        elif stage == "match_samples":
+            match_samples_stage(args, args.zarr, ancestors_ts_path, undated_path)
+        else:
+            date_stage(args, undated_path, output_path)
 
 if __name__ == "__main__":
     main()